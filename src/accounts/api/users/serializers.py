@@ -1,11 +1,8 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
 
 from rest_framework import serializers
 from rest_framework.reverse import reverse as api_reverse
 
-from grades.models import Grade
-from tags.models import Tag
 from accounts.models import ModuleType
 
 User = get_user_model()
@@ -30,14 +27,7 @@ class UserDetailSerializer(serializers.ModelSerializer):
         ]
 
     def get_grade(self, obj):
-        grade_dict = {}
-        grade_set = Grade.objects.filter(user=obj)
-        tags = set(grade_set.values_list('tag', flat=True))
-        for tag in tags:
-            total_good = grade_set.filter(tag=tag).aggregate(Sum('good_labels'))['good_labels__sum']
-            total = grade_set.filter(tag=tag).aggregate(Sum('labels'))['labels__sum']
-            grade_dict[Tag.objects.get(id=tag).name] = total_good/total
-        return grade_dict
+        return {skill.tag.name: skill.accuracy for skill in obj.skills.all()}
 
     def get_uri(self, obj):
         request = self.context.get('request')
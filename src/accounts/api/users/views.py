@@ -25,7 +25,7 @@ class OrdinaryUserAPIView(generics.ListAPIView):
     """
     serializer_class = UserDetailSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    queryset = User.objects.filter(user_type='ordinary_user')
+    queryset = User.objects.filter(user_type='ordinary_user').prefetch_related('skills__tag')
 
     search_fields = ('email', 'full_name')
     ordering_fields = ('email', 'full_name')
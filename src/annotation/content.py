@@ -0,0 +1,137 @@
+import os
+import csv
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from annotation.utils import get_filename_ext
+from annotation.payloads import load_row
+
+
+def read_text_file(path, text_files=True):
+    name, ext = get_filename_ext(path)
+    if ext == '.csv':
+        with open(path, encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                return row
+    elif text_files:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    return ''
+
+
+class TextContentLoader(object):
+    """
+    Loads the text_content of tasks and questions.
+
+    Rows kept in the payload column are parsed straight away. Anything read from
+    disk (packed payload records, csv and text files) goes through a bounded
+    in-process LRU and, when TEXT_CONTENT_CACHE_ALIAS names a Django cache, a
+    shared second tier. Entries are keyed by path and mtime, so a rewritten file
+    is never served stale; `invalidate` drops a whole project or quiz at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def max_entries(self):
+        return settings.TEXT_CONTENT_CACHE_SIZE
+
+    @property
+    def shared_cache(self):
+        alias = settings.TEXT_CONTENT_CACHE_ALIAS
+        if alias:
+            return caches[alias]
+        return None
+
+    def generation(self, scope):
+        cache = self.shared_cache
+        if cache is None:
+            return 0
+        return cache.get('text_content:generation:%s' % scope, 0)
+
+    def shared_key(self, key):
+        scope, path, mtime, index = key
+        digest = hashlib.md5(('%s:%s:%s:%s' % key).encode('utf-8')).hexdigest()
+        return 'text_content:%s:%s' % (self.generation(scope), digest)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        cache = self.shared_cache
+        if cache is not None:
+            value = cache.get(self.shared_key(key))
+            if value is not None:
+                self.shared_hits += 1
+                self.put(key, value, shared=False)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, shared=True):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        cache = self.shared_cache
+        if shared and cache is not None:
+            cache.set(self.shared_key(key), value)
+
+    def invalidate(self, scope):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == scope]:
+                del self.entries[key]
+        cache = self.shared_cache
+        if cache is not None:
+            cache.set('text_content:generation:%s' % scope, self.generation(scope) + 1, None)
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+        }
+
+    def load(self, obj, text_files=True):
+        if obj.payload:
+            return load_row(obj.payload)
+        store = obj.payload_store
+        if obj.payload_index is not None:
+            path, index = store.file.path, obj.payload_index
+        elif obj.file_path:
+            path, index = obj.file_path, None
+        else:
+            return None
+        key = (store.name, path, os.stat(path).st_mtime_ns, index)
+        value = self.get(key)
+        if value is None:
+            if index is None:
+                value = read_text_file(path, text_files)
+            else:
+                value = store.load(None, index)
+            self.put(key, value)
+        return value
+
+
+text_content_loader = TextContentLoader()
+
+
+def get_text_content(obj, text_files=True):
+    return text_content_loader.load(obj, text_files)
+
+
+def invalidate_text_content(*scope):
+    text_content_loader.invalidate(os.path.join(*[str(part) for part in scope]))
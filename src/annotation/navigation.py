@@ -0,0 +1,33 @@
+from django.db.models import IntegerField, OuterRef, Subquery
+
+
+def neighbour_subqueries(model, scope, field='created'):
+    siblings = model.objects.filter(**{name: OuterRef(name) for name in scope})
+    previous = siblings.filter(**{field + '__lt': OuterRef(field)}).order_by('-' + field, '-id').values('id')[:1]
+    following = siblings.filter(**{field + '__gt': OuterRef(field)}).order_by(field, 'id').values('id')[:1]
+    return {
+        'previous_id': Subquery(previous, output_field=IntegerField()),
+        'next_id': Subquery(following, output_field=IntegerField()),
+    }
+
+
+def with_neighbour_ids(queryset, scope, field='created'):
+    """
+    Annotates every row with the ids of the rows just before and after it in
+    `field` order among the rows sharing its `scope` fields, so a whole page
+    gets its navigation in the query that loads it.
+    """
+    return queryset.annotate(**neighbour_subqueries(queryset.model, scope, field))
+
+
+def neighbour_ids(obj, scope, field='created'):
+    """
+    (previous_id, next_id) of obj, read from `with_neighbour_ids` annotations when
+    present, otherwise looked up with a single query and remembered on obj.
+    """
+    if not hasattr(obj, 'previous_id'):
+        queryset = with_neighbour_ids(type(obj).objects.filter(pk=obj.pk), scope, field)
+        row = queryset.values('previous_id', 'next_id').first() or {}
+        obj.previous_id = row.get('previous_id')
+        obj.next_id = row.get('next_id')
+    return obj.previous_id, obj.next_id
@@ -0,0 +1,101 @@
+import os
+import json
+import mmap
+import struct
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def dump_row(row):
+    return json.dumps(row, ensure_ascii=False)
+
+
+def load_row(payload):
+    return json.loads(payload, object_pairs_hook=OrderedDict)
+
+
+class PackedPayloadFile(object):
+    """
+    Append-only file of length-prefixed records with an array-backed offset index.
+
+    `<name>.pack` holds the records, `<name>.idx` holds one unsigned 64 bit offset
+    per record, so record n is found with a single slice of the mapped index.
+    Both files are memory-mapped once per process and re-mapped when they change.
+    """
+    length = struct.Struct('>I')
+    _maps = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+
+    def append(self, rows):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        offsets = array('Q')
+        with open(self.path, 'ab') as f:
+            position = f.tell()
+            for row in rows:
+                data = dump_row(row).encode('utf-8')
+                f.write(self.length.pack(len(data)))
+                f.write(data)
+                offsets.append(position)
+                position += self.length.size + len(data)
+        with open(self.index_path, 'ab') as f:
+            first = f.tell() // offsets.itemsize
+            offsets.tofile(f)
+        return list(range(first, first + len(offsets)))
+
+    def _map(self, path):
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime)
+        cached = self._maps.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(path, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self._maps[path] = (key, view)
+        return view
+
+    def read(self, number):
+        offset = self._map(self.index_path).cast('Q')[number]
+        data = self._map(self.path)
+        size, = self.length.unpack_from(data, offset)
+        start = offset + self.length.size
+        return load_row(str(data[start:start + size], 'utf-8'))
+
+    def clear(self):
+        for path in (self.path, self.index_path):
+            self._maps.pop(path, None)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class PayloadStore(object):
+    """
+    Where csv rows of one project or quiz live.
+
+    PAYLOAD_STORAGE decides how new rows are written: 'database' keeps them in
+    the payload column, 'packed' appends them to a PackedPayloadFile and keeps
+    only the record number. Rows written either way can always be read back.
+    """
+
+    def __init__(self, *name):
+        self.name = os.path.join(*[str(part) for part in name])
+        self.file = PackedPayloadFile(os.path.join(settings.PAYLOAD_ROOT, '%s.pack' % self.name))
+
+    def save(self, rows):
+        if settings.PAYLOAD_STORAGE == 'packed':
+            return [{'payload_index': number} for number in self.file.append(rows)]
+        return [{'payload': dump_row(row)} for row in rows]
+
+    def load(self, payload, payload_index):
+        if payload:
+            return load_row(payload)
+        if payload_index is not None:
+            return self.file.read(payload_index)
+        return None
+
+    def clear(self):
+        self.file.clear()
@@ -1,6 +1,163 @@
+import json
+import base64
+import datetime
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """Keeps the microseconds DjangoJSONEncoder cuts off, a cursor must hold the exact key."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super(CursorJSONEncoder, self).default(o)
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Cursor pagination keyed on a tuple of columns, `cursor_ordering` on the view
+    ('id' by default). Each page is fetched with `WHERE key > last key ORDER BY
+    key LIMIT n`, so its cost does not depend on how deep it is, and no count is run.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    default_page_size = 10
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.default_page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            return cursor['p'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        data = json.dumps({'p': position, 'r': int(reverse)}, cls=CursorJSONEncoder)
+        encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def after(self, position, reverse):
+        # Rows strictly after `position` in key order. MySQL sorts NULL first
+        # ascending and last descending, which is what the null branches follow.
+        condition = Q(pk__in=[])
+        ties = Q()
+        for field, value in zip(self.ordering, position):
+            descending = field.startswith('-') != reverse
+            name = field.lstrip('-')
+            if value is None:
+                greater = Q(pk__in=[]) if descending else Q(**{name + '__isnull': False})
+                equal = Q(**{name + '__isnull': True})
+            else:
+                greater = Q(**{name + ('__lt' if descending else '__gt'): value})
+                if descending:
+                    greater |= Q(**{name + '__isnull': True})
+                equal = Q(**{name: value})
+            condition |= ties & greater
+            ties &= equal
+        return condition
+
+    def order_by(self, reverse):
+        if not reverse:
+            return self.ordering
+        return [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+
+    def position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = list(getattr(view, 'cursor_ordering', ('id',)))
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request)
+        reverse = cursor[1] if cursor else False
+        if cursor:
+            queryset = queryset.filter(self.after(cursor[0], reverse))
+        page = list(queryset.order_by(*self.order_by(reverse))[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.position(self.page[0]), True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
 
 
 class RESTAPIPagination(pagination.LimitOffsetPagination):
+    """
+    limit/offset paging by default; `?count=false` skips the COUNT(*) query,
+    and `?cursor=` or `?pagination=cursor` switches to KeysetPagination.
+    """
     default_limit = 10
-    max_limit = 20
+    max_limit = 100
+    count_query_param = 'count'
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        keyset = self.keyset_class
+        if request.query_params.get('pagination') == 'cursor' or keyset.cursor_query_param in request.query_params:
+            self.keyset = keyset()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        if request.query_params.get(self.count_query_param) not in ('false', '0'):
+            return super(RESTAPIPagination, self).paginate_queryset(queryset, request, view)
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = None
+        self.request = request
+        self.display_page_controls = False
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_more = len(page) > self.limit
+        return page[:self.limit]
+
+    def get_next_link(self):
+        if self.count is None:
+            if not self.has_more:
+                return None
+            url = self.request.build_absolute_uri()
+            url = replace_query_param(url, self.limit_query_param, self.limit)
+            return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+        return super(RESTAPIPagination, self).get_next_link()
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super(RESTAPIPagination, self).get_paginated_response(data)
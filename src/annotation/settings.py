@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 
 import os
 import pymysql
+from datetime import timedelta
 import djcelery
 
 from annotation.restconf.main import *
@@ -25,6 +26,8 @@ CELERY_RESULT_BACKEND = 'djcelery.backends.database:DatabaseBackend'
 
 CELERY_IMPORTS = (
     'tasks.tasks',
+    'grades.tasks',
+    'quizzes.tasks',
 )
 
 
@@ -175,6 +178,73 @@ RESULT_URL = 'http://10.1.62.101/result/'
 
 RESULT_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'result')
 
+# Tasks read per query while exporting results, and how long a result file build may run before it is taken as abandoned
+
+RESULT_EXPORT_CHUNK_SIZE = 2000
+
+RESULT_EXPORT_LOCK_SECONDS = 60 * 60
+
+# Delta exports look this far behind the given since, so changes stamped before a watermark but committed after it are not lost
+
+RESULT_EXPORT_DELTA_MARGIN_SECONDS = 60
+
+
+# Task ingestion
+
+TASK_INGEST_BATCH_SIZE = 1000
+
+# A running ingestion that has not committed a batch for this long is taken as abandoned and may be resumed
+
+TASK_INGEST_STALE_SECONDS = 10 * 60
+
+# Worker processes that hash and inspect uploaded files during ingestion (None: one per core, 0: inline),
+# and how many files may be in flight per worker at once
+
+TASK_INGEST_WORKERS = None
+
+TASK_INGEST_IN_FLIGHT_PER_WORKER = 4
+
+# How long a contribution handed out to an annotator stays reserved for them
+
+CONTRIBUTION_LEASE_SECONDS = 30 * 60
+
+# How many contributions a batch checkout hands out by default and at most
+
+CHECKOUT_DEFAULT_SIZE = 10
+
+CHECKOUT_MAX_SIZE = 100
+
+# Where csv rows of tasks and questions are kept: 'database' or 'packed'
+
+PAYLOAD_STORAGE = 'database'
+
+PAYLOAD_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'payload')
+
+# text_content cache: entries kept per process, plus an optional Django cache alias shared by all workers
+
+TEXT_CONTENT_CACHE_SIZE = 1024
+
+TEXT_CONTENT_CACHE_ALIAS = None
+
+# Write quiz answers only when a label is given, instead of one blank answer per question for every taker
+
+QUIZ_LAZY_ANSWERS = False
+
+# Labelled contributions and inspections are submitted this long after their first label, by a periodic sweep
+
+AUTO_SUBMIT_DELAY_SECONDS = 5
+
+AUTO_SUBMIT_SWEEP_SECONDS = 10
+
+AUTO_SUBMIT_BATCH_SIZE = 500
+
+CELERYBEAT_SCHEDULE = {
+    'submit-due': {
+        'task': 'tasks.tasks.submit_due',
+        'schedule': timedelta(seconds=AUTO_SUBMIT_SWEEP_SECONDS),
+    },
+}
+
 
 # Custom user model
 AUTH_USER_MODEL = 'accounts.User'
@@ -0,0 +1,44 @@
+import os
+import hashlib
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every file under the sha1 of its content, fanned out into two levels
+    of directories: `ab/cd/abcd....ext`. The name is known only once the content
+    has been read, so nothing needs to list a directory to avoid collisions, and
+    saving content that is already stored just returns the existing name.
+    """
+    hash_name = 'sha1'
+    incoming_dir = '.incoming'
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def hashed_name(self, digest, ext):
+        return os.path.join(digest[:2], digest[2:4], digest + ext)
+
+    def _save(self, name, content):
+        ext = os.path.splitext(name)[1].lower()
+        incoming = os.path.join(self.location, self.incoming_dir)
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.new(self.hash_name)
+        with tempfile.NamedTemporaryFile(dir=incoming, delete=False) as f:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                f.write(chunk)
+        name = self.hashed_name(digest.hexdigest(), ext)
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(f.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(f.name, path)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+        return name.replace('\\', '/')
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Grade
+from .models import Grade, Skill
 # Register your models here.
 
 admin.site.register(Grade)
+
+admin.site.register(Skill)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from grades.models import Skill
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-tag skills of users from their grades.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or None
+        count = Skill.refresh(user_ids)
+        self.stdout.write(self.style.SUCCESS('Refreshed %d skills.' % count))
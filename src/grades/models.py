@@ -1,10 +1,13 @@
-from django.db import models
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Count, Sum, Case, When, F
 from django.dispatch import receiver
 from django.db.models.signals import post_save
 from django.contrib.auth import get_user_model
 
 from projects.models import Project
 from tags.models import Tag
+from grades.tasks import compute_grades
 
 
 User = get_user_model()
@@ -21,26 +24,75 @@ class Grade(models.Model):
     def __str__(self):
         return str(self.id) + '_Project' + str(self.project.id) + '_' + self.user.full_name + '_' + self.tag.name
 
+    @classmethod
+    def compute(cls, project_id):
+        """
+        Scores every contributor of a project with one aggregate query over
+        Contribution joined to Task, then replaces the project's grades in bulk.
+        """
+        Contribution = apps.get_model('tasks', 'Contribution')
+        scores = Contribution.objects.filter(project_id=project_id, contributor__isnull=False).order_by()\
+            .values('contributor').annotate(
+                labels=Count('id'),
+                good_labels=Sum(Case(When(label=F('task__label'), then=1), default=0, output_field=models.IntegerField())),
+            )
+        tag_ids = list(Project.tags.through.objects.filter(project_id=project_id).values_list('tag_id', flat=True))
+        grades = [
+            cls(project_id=project_id, user_id=score['contributor'], tag_id=tag_id,
+                labels=score['labels'], good_labels=score['good_labels'])
+            for score in scores for tag_id in tag_ids
+        ]
+        with transaction.atomic():
+            user_ids = set(cls.objects.filter(project_id=project_id).values_list('user_id', flat=True))
+            user_ids.update(score['contributor'] for score in scores)
+            cls.objects.filter(project_id=project_id).delete()
+            cls.objects.bulk_create(grades)
+            Skill.refresh(user_ids)
+        return grades
+
+
+class Skill(models.Model):
+    """
+    A user's accuracy on one tag over all graded projects, kept so that user
+    lists read one row per tag instead of summing grades on every request.
+    """
+    user = models.ForeignKey(User, related_name='skills')
+    tag = models.ForeignKey(Tag, related_name='skills')
+    good_labels = models.IntegerField(default=0)
+    labels = models.IntegerField(default=0)
+    accuracy = models.FloatField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'tag')
+
+    def __str__(self):
+        return str(self.user) + '_' + self.tag.name
+
+    @classmethod
+    def refresh(cls, user_ids=None):
+        totals = Grade.objects.order_by().values('user', 'tag').annotate(
+            total_good=Sum('good_labels'),
+            total=Sum('labels'),
+        )
+        stale = cls.objects.all()
+        if user_ids is not None:
+            totals = totals.filter(user__in=user_ids)
+            stale = stale.filter(user__in=user_ids)
+        skills = [
+            cls(user_id=row['user'], tag_id=row['tag'],
+                good_labels=row['total_good'] or 0, labels=row['total'] or 0,
+                accuracy=(row['total_good'] or 0) / row['total'] if row['total'] else None)
+            for row in totals
+        ]
+        with transaction.atomic():
+            stale.delete()
+            cls.objects.bulk_create(skills)
+        return len(skills)
+
 
 @receiver(post_save, sender=Project)
-def receiver(sender, instance, *args, **kwargs):    
-    if instance.project_status == 'completed':
-        old_grade_set = Grade.objects.filter(project=instance)
-        if old_grade_set:
-            old_grade_set.delete()
-        contribution_set = instance.contribution_set.all()
-        contributors = set(contribution_set.values_list('contributor', flat=True))
-        for user in contributors:
-            user_done_set = contribution_set.filter(contributor=user)
-            labels = user_done_set.count()
-            good_labels = 0
-            for contribution in user_done_set:
-                if contribution.label == contribution.task.label:
-                    good_labels += 1
-
-            for tag in instance.tags.all():
-                Grade.objects.create(project=instance,
-                                     user_id=user,
-                                     tag=tag,
-                                     labels=labels,
-                                     good_labels=good_labels)
+def receiver(sender, instance, *args, **kwargs):
+    if instance.status_id == 'completed':
+        project_id = instance.id
+        transaction.on_commit(lambda: compute_grades.delay(project_id))
@@ -0,0 +1,8 @@
+from celery import task
+
+
+@task(name='grades.tasks.compute_grades', acks_late=True)
+def compute_grades(project_id):
+    from grades.models import Grade
+
+    Grade.compute(project_id)
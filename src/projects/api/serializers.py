@@ -136,11 +136,15 @@ class ProjectSerializer(serializers.ModelSerializer):
         return TargetSerializer(target).data
 
     def get_is_in(self, obj):
+        if hasattr(obj, 'is_in'):
+            return obj.is_in
         request = self.context.get('request')
         user_id = request.user.id
         return obj.contributors.filter(id=user_id).exists()
 
     def get_my_quantity(self, obj):
+        if hasattr(obj, 'my_quantity'):
+            return obj.my_quantity
         request = self.context.get('request')
         user = request.user
         if obj.quantity != 0:
@@ -148,6 +152,14 @@ class ProjectSerializer(serializers.ModelSerializer):
         return 0
 
     def get_my_status(self, obj):
+        if hasattr(obj, 'my_quiz_status'):
+            if not obj.quiz_id:
+                return 'go_to_task'
+            if obj.my_quiz_status != 'submitted':
+                return 'go_to_quiz'
+            if obj.my_quiz_accuracy < obj.accuracy_requirement:
+                return 'quiz_failed'
+            return 'go_to_task'
         request = self.context.get('request')
         user = request.user
         quiz = obj.quiz
@@ -0,0 +1,124 @@
+import json
+from datetime import datetime
+
+from django.db import connection
+from django.contrib.auth import get_user_model
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework.reverse import reverse as api_reverse
+
+from projects.models import Project, Status
+from tasks.models import Task
+from targets.models import Target, TargetType
+from tags.models import Tag
+from quizzes.models import QuestionType
+
+
+User = get_user_model()
+
+
+class ProjectAPITestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='admin@gmail.com')
+        target_type = TargetType.objects.create(name='Classification', chinese_name='分类')
+        self.project_type = QuestionType.objects.create(name='sentiment', chinese_name='情感', type=target_type)
+        self.target = Target.objects.create(user=self.user, name='target_0', type=target_type, description='')
+        self.tag = Tag.objects.create(name='tag_0', founder=self.user)
+        self.status = Status.objects.create(
+            id=3,
+            project_status='answering',
+            project_status_name='进行中',
+            verify_status='passed',
+            verify_status_name='审核通过',
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def create_projects(self, count):
+        for i in range(count):
+            project = Project.objects.create(
+                project_type=self.project_type,
+                founder=self.user,
+                contributors_char=str(self.user.id),
+                project_target=self.target,
+                status=self.status,
+            )
+            project.tags.add(self.tag)
+
+
+class ProjectListAPITestCase(ProjectAPITestCase):
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        list_url = api_reverse('api-projects:list')
+        self.create_projects(2)
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.client.get(list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.create_projects(8)
+        with CaptureQueriesContext(connection) as full_page:
+            response = self.client.get(list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(small_page), len(full_page))
+        self.assertTrue(all(project['is_in'] for project in response.data['results']))
+        self.assertEqual(response.data['results'][0]['my_quantity'], 0)
+
+
+@override_settings(RESULT_EXPORT_DELTA_MARGIN_SECONDS=0)
+class ProjectResultExportAPITestCase(ProjectAPITestCase):
+    def setUp(self):
+        super(ProjectResultExportAPITestCase, self).setUp()
+        self.create_projects(1)
+        self.project = Project.objects.get()
+        self.tasks = [
+            Task.objects.create(project=self.project, payload=json.dumps({'text': str(i)}), label='a')
+            for i in range(2)
+        ]
+        self.export_url = api_reverse('api-projects:export', kwargs={'id': self.project.id})
+
+    def export(self, since):
+        response = self.client.get(self.export_url, {'since': since, 'file_format': 'jsonl'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        return response, rows
+
+    def test_watermark_round_trip(self):
+        response, rows = self.export('2000-01-01T00:00:00')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['task_id'] for row in rows], [task.id for task in self.tasks])
+
+        changed = self.tasks[1]
+        changed.label = 'b'
+        changed.save()
+        response, rows = self.export(response['X-Result-Watermark'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['task_id'], row['label']) for row in rows], [(changed.id, 'b')])
+
+    def test_delta_export_is_owner_only(self):
+        self.client.force_authenticate(user=User.objects.create(email='other@gmail.com'))
+        response = self.client.get(self.export_url, {'since': '2000-01-01T00:00:00'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProjectResultCursorAPITestCase(ProjectAPITestCase):
+    def test_cursor_pages_across_one_millisecond(self):
+        self.create_projects(1)
+        project = Project.objects.get()
+        ids = []
+        for microsecond in (100, 200, 300):
+            task = Task.objects.create(project=project, label='a')
+            Task.objects.filter(id=task.id).update(updated=datetime(2018, 1, 1, 10, 0, 0, microsecond))
+            ids.append(task.id)
+        url = api_reverse('api-projects:result', kwargs={'id': project.id})
+
+        response = self.client.get(url, {'pagination': 'cursor', 'limit': 1})
+        seen = [row['id'] for row in response.data['results']]
+        while response.data['next']:
+            last = response
+            response = self.client.get(response.data['next'])
+            seen += [row['id'] for row in response.data['results']]
+        self.assertEqual(seen, ids)
+
+        response = self.client.get(last.data['next'])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], ids[1:2])
@@ -14,7 +14,9 @@ from .views import (
     ProjectMyContributionView,
     ProjectMyInspectionView,
     ProjectResultDownloadView,
+    ProjectResultExportView,
     ProjectInspectorView,
+    ProjectIngestView,
 )
 
 
@@ -32,5 +34,7 @@ urlpatterns = [
     url(r'^(?P<id>\d+)/my_contribution/$', ProjectMyContributionView.as_view(), name='my-contribution'),
     url(r'^(?P<id>\d+)/my_inspection/$', ProjectMyInspectionView.as_view(), name='my-inspection'),
     url(r'^(?P<id>\d+)/download_result/$', ProjectResultDownloadView.as_view(), name='download-result'),
+    url(r'^(?P<id>\d+)/export/$', ProjectResultExportView.as_view(), name='export'),
     url(r'^(?P<id>\d+)/inspector/$', ProjectInspectorView.as_view(), name='inspector'),
+    url(r'^(?P<id>\d+)/ingest/$', ProjectIngestView.as_view(), name='ingest'),
 ]
@@ -1,14 +1,25 @@
-import os
-import csv
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from django.conf import settings
-from django.core.files.base import ContentFile
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import urlquote
+from django.utils.dateparse import parse_datetime
 from rest_framework.response import Response
 from rest_framework import generics, mixins, permissions
 
 from projects.models import Project, Status
+from tasks.models import IngestJob
+from tasks.tasks import ingest_project
+from tasks.exports import (
+    RESULT_FORMATS,
+    get_result_format,
+    iter_result_rows,
+    result_file_name,
+    queue_result_file,
+)
 from .serializers import (
     ProjectSerializer,
     ProjectInlineUserSerializer,
@@ -21,8 +32,10 @@ from tasks.api.serializers import (
     TaskResultSerializer,
     ContributeResultSerializer,
     InspectResultSerializer,
+    IngestJobSerializer,
+    ResultFileJobSerializer,
 )
-from accounts.api.permissions import IsOwnerOrReadOnly, IsStaff
+from accounts.api.permissions import IsOwnerOrReadOnly, IsOwner, IsStaff
 from accounts.api.users.serializers import UserInlineSerializer, EditContributorsSerializer
 
 
@@ -46,6 +59,9 @@ class ProjectAPIView(mixins.CreateModelMixin, generics.ListAPIView):
     ordering_fields = ('project_type', 'timestamp')
     filter_fields = ('project_type',)
 
+    def filter_queryset(self, queryset):
+        return super(ProjectAPIView, self).filter_queryset(queryset).for_list(self.request.user)
+
     def post(self, request, *args, **kwargs):
         return self.create(request, *args, **kwargs)
 
@@ -176,7 +192,8 @@ class ProjectAddContributorsView(generics.ListAPIView, mixins.UpdateModelMixin):
         project = get_object_or_404(Project, id=project_id)
         if project_id is None:
             return User.objects.none()
-        return User.objects.exclude(contributed_projects=project_id).exclude(inspected_projects=project_id)
+        return User.objects.exclude(contributed_projects=project_id).exclude(inspected_projects=project_id)\
+            .prefetch_related('skills__tag')
 
     def put(self, request, *args, **kwargs):
         project_id = self.kwargs.get("id", None)
@@ -212,7 +229,7 @@ class ProjectDeleteContributorsView(generics.ListAPIView, mixins.UpdateModelMixi
         if project_id is None:
             return User.objects.none()
         project = get_object_or_404(Project, id=project_id)
-        return project.contributors.all()
+        return project.contributors.prefetch_related('skills__tag')
 
     def put(self, request, *args, **kwargs):
         project_id = self.kwargs.get("id", None)
@@ -244,10 +261,12 @@ class ProjectVerifyListView(generics.ListAPIView):
         queryset = Project.objects.exclude(status='unreleased').exclude(founder=user)
         verify_status = self.request.GET.get("verify_status", None)
         if verify_status:
-            project_ids = [x.id for x in queryset if x.verify_status == verify_status]
-            queryset = Project.objects.filter(pk__in=project_ids)
+            queryset = queryset.filter(status__verify_status=verify_status)
         return queryset
 
+    def filter_queryset(self, queryset):
+        return super(ProjectVerifyListView, self).filter_queryset(queryset).for_list(self.request.user)
+
 
 class ProjectVerifyDetailView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
     """
@@ -321,6 +340,7 @@ class ProjectResultView(generics.ListAPIView):
 
     search_fields = ()
     ordering_fields = ('id', 'updated',)
+    cursor_ordering = ('updated', 'id')
     filter_fields = ('label',)
 
     def get_queryset(self, *args, **kwargs):
@@ -339,6 +359,7 @@ class ProjectMyContributionView(generics.ListAPIView):
 
     search_fields = ()
     ordering_fields = ('id', 'created', 'updated',)
+    cursor_ordering = ('created', 'id')
     filter_fields = ('label',)
 
     def get_queryset(self, *args, **kwargs):
@@ -360,6 +381,7 @@ class ProjectMyInspectionView(generics.ListAPIView):
 
     search_fields = ()
     ordering_fields = ('id', 'created', 'updated',)
+    cursor_ordering = ('created', 'id')
     filter_fields = ('label',)
 
     def get_queryset(self, *args, **kwargs):
@@ -374,46 +396,76 @@ class ProjectMyInspectionView(generics.ListAPIView):
 class ProjectResultDownloadView(generics.RetrieveAPIView):
     """
     get:
-        获取任务结果文件链接
+        获取任务结果文件链接，文件尚未生成时转入后台生成并返回202，
+        result_file_job 为后台生成的状态，上次生成失败时 error 为失败原因并已重新排队
     """
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
     serializer_class = ProjectResultURLSerializer
     lookup_field = 'id'
 
-    def create_result_file(self, instance):
-        try:
-            file_name = '%s_%s_%s_result.csv' % (instance.id, instance.name, instance.project_type)
-            instance.result_file.save(file_name, ContentFile('RESULT'))
-            f = open(os.path.join(settings.RESULT_ROOT, file_name), mode='w', encoding='utf-8', newline='')
-            queryset = instance.task_set.all()
-
-            for i, obj in enumerate(queryset):
-                path = obj.file_path
-                reader = csv.DictReader(open(path, encoding='utf-8'))
-                fieldnames = reader.fieldnames
-                fieldnames.append('label')
-                if i == 0:
-                    writer = csv.DictWriter(f, fieldnames=fieldnames)
-                    writer.writeheader()
-                for row in reader:
-                    row['label'] = obj.label
-                    writer.writerow(row)
-        except:
-            #instance.result_file.delete()
-            return Response({"message": "Fail to create result file!"}, status=400)
-
     def get(self, request, *args, **kwargs):
         project_id = self.kwargs.get("id", None)
         project = get_object_or_404(Project, id=project_id)
         if project.project_status == 'completed':
-            if not project.result_file:
-                self.create_result_file(project)
             serializer = self.get_serializer(project)
+            if not project.result_file:
+                job = queue_result_file(project)
+                data = dict(serializer.data, result_file_job=ResultFileJobSerializer(job).data)
+                return Response(data, status=202)
             return Response(serializer.data)
         else:
             return Response({"message": "Project is not completed"}, status=400)
 
 
+class ProjectResultExportView(generics.GenericAPIView):
+    """
+    get:
+        下载任务结果，边生成边传输；file_format 可选 csv（默认）、csv.gz、jsonl、jsonl.gz，
+        安装 zstandard 后支持 csv.zst、jsonl.zst，安装 pyarrow 后支持 arrow、parquet。
+        带 since（上次响应头 X-Result-Watermark 的值）时只返回此后有变化的任务，并附 task_id 列，
+        since 之前 RESULT_EXPORT_DELTA_MARGIN_SECONDS 内的变化会重复返回，按 task_id 去重即可；
+        带 since 的导出包含未完成的标注，仅任务创建者可用
+    """
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    lookup_field = 'id'
+
+    def get_permissions(self):
+        if self.request.GET.get('since'):
+            return [permissions.IsAuthenticated(), IsOwner()]
+        return super(ProjectResultExportView, self).get_permissions()
+
+    def get(self, request, *args, **kwargs):
+        project_id = self.kwargs.get("id", None)
+        project = get_object_or_404(Project, id=project_id)
+        self.check_object_permissions(request, project)
+        since = request.GET.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"message": "since should be an ISO 8601 timestamp"}, status=400)
+            # USE_TZ is off, the database only takes naive local times.
+            if timezone.is_aware(since):
+                since = timezone.make_naive(since)
+            # Rows stamped just before the last watermark may have committed after it was taken.
+            since -= timedelta(seconds=settings.RESULT_EXPORT_DELTA_MARGIN_SECONDS)
+        elif project.project_status != 'completed':
+            return Response({"message": "Project is not completed"}, status=400)
+        result_format = get_result_format(request.GET.get('file_format'))
+        if result_format is None:
+            return Response(
+                {"message": "Unknown file_format, choose from: %s" % ', '.join(RESULT_FORMATS)},
+                status=400,
+            )
+        watermark = timezone.now()
+        rows = iter_result_rows(project, since=since, until=watermark) if since else iter_result_rows(project)
+        response = StreamingHttpResponse(result_format.iter_chunks(rows), content_type=result_format.content_type)
+        response['X-Result-Watermark'] = watermark.isoformat()
+        response['Content-Disposition'] = 'attachment; filename="%s"' % urlquote(
+            result_file_name(project, result_format)
+        )
+        return response
+
+
 class ProjectInspectorView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
     """
     get:
@@ -457,3 +509,31 @@ class ProjectInspectorView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
                 return Response({"message": "No inspector since repetition rate is 1.0"}, status=400)
         else:
             return Response({"message": "Only Classification projects have a inspector"}, status=400)
+
+
+class ProjectIngestView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
+    """
+    get:
+        【任务管理】 获取任务文件的导入进度（已解析行数、已导入行数、已读字节数、预计剩余秒数）
+
+    put:
+        【任务管理】 从上次提交的位置继续中断或失败的导入
+    """
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    serializer_class = IngestJobSerializer
+
+    def get_object(self, *args, **kwargs):
+        project_id = self.kwargs.get("id", None)
+        job = get_object_or_404(IngestJob, project_id=project_id)
+        self.check_object_permissions(self.request, job)
+        return job
+
+    def put(self, request, *args, **kwargs):
+        job = self.get_object()
+        if job.state == IngestJob.FINISHED:
+            return Response({"message": "Ingestion already finished."}, status=400)
+        if not IngestJob.claim(job.id, [IngestJob.FAILED], IngestJob.PENDING):
+            return Response({"message": "Ingestion is already queued or running."}, status=400)
+        Project.objects.filter(id=job.project_id).update(status='ingesting')
+        ingest_project.delay(job.id)
+        return self.get(request, *args, **kwargs)
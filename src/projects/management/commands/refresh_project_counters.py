@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from projects.models import ProjectCounters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the progress counters of projects from their tasks, contributions and inspections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        project_ids = options['project_ids'] or None
+        count = ProjectCounters.refresh(project_ids)
+        self.stdout.write(self.style.SUCCESS('Refreshed counters of %d projects.' % count))
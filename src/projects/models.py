@@ -1,7 +1,9 @@
-import os
 import re
 
-from django.db import models
+from django.db import models, transaction
+from django.apps import apps
+from django.db.models import Count, Case, When, F, Exists, OuterRef, Subquery, Prefetch
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.dispatch import receiver
 from django.db.models.signals import pre_save, post_save
@@ -9,23 +11,20 @@ from django.contrib.auth import get_user_model
 from django.core.files.storage import FileSystemStorage
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-from annotation.utils import get_filename_ext, random_string_generator
+from annotation.utils import get_filename_ext
+from annotation.storage import ContentAddressedStorage
 from targets.models import Target, TargetType
 from tags.models import Tag
-from quizzes.models import Quiz, QuestionType
+from quizzes.models import Quiz, QuestionType, QuizContributor
 
 
 User = get_user_model()
 
 
 def upload_project_file_path(instance, filename):
+    # ContentAddressedStorage names the file after its content, only the extension is kept.
     name, ext = get_filename_ext(filename)
-    while True:
-        new_filename = random_string_generator()
-        if new_filename not in os.listdir(settings.MEDIA_ROOT):
-            break
-    final_filename = '{new_filename}{ext}'.format(new_filename=new_filename, ext=ext)
-    return final_filename
+    return 'upload{ext}'.format(ext=ext)
 
 
 class Status(models.Model):
@@ -39,6 +38,31 @@ class Status(models.Model):
         return str(self.project_status)
 
 
+class ProjectQuerySet(models.QuerySet):
+    def for_list(self, user):
+        """
+        Loads everything ProjectSerializer reads in a constant number of queries:
+        related rows are joined or prefetched, and the caller's membership,
+        labelled count and quiz result are computed as annotations.
+        """
+        Contribution = apps.get_model('tasks', 'Contribution')
+        my_quantity = Contribution.objects.filter(project=OuterRef('pk'), contributor=user.id).exclude(label='')\
+            .order_by().values('project').annotate(count=Count('id')).values('count')
+        my_quiz = QuizContributor.objects.filter(quiz=OuterRef('quiz'), contributor=user.id)
+        return self.select_related(
+            'project_type', 'quiz', 'status', 'counters', 'project_target__type',
+        ).prefetch_related(
+            'tags__tagged_quizzes', 'tags__child_tags', 'contributors', 'project_target__target_quizzes',
+            Prefetch('tags__tagged_projects', queryset=Project.objects.only('id')),
+            Prefetch('project_target__target_projects', queryset=Project.objects.only('id', 'project_target')),
+        ).annotate(
+            is_in=Exists(Project.contributors.through.objects.filter(project=OuterRef('pk'), user=user.id)),
+            my_quantity=Coalesce(Subquery(my_quantity, output_field=models.IntegerField()), 0),
+            my_quiz_status=Subquery(my_quiz.values('status')[:1], output_field=models.CharField()),
+            my_quiz_accuracy=Subquery(my_quiz.values('accuracy')[:1], output_field=models.DecimalField()),
+        )
+
+
 class Project(models.Model):
     name = models.CharField(max_length=128, default='unnamed_project')
     tags = models.ManyToManyField(Tag, blank=True, related_name='tagged_projects')
@@ -64,7 +88,7 @@ class Project(models.Model):
     project_target = models.ForeignKey(Target, related_name='target_projects')
     project_file = models.FileField(
         upload_to=upload_project_file_path,
-        storage=FileSystemStorage(location=settings.MEDIA_ROOT),
+        storage=ContentAddressedStorage(location=settings.MEDIA_ROOT),
         blank=True,
         null=True,
     )
@@ -77,6 +101,8 @@ class Project(models.Model):
         null=True,
     )
 
+    objects = ProjectQuerySet.as_manager()
+
     def __str__(self):
         return str(self.id) + '_' + str(self.project_type)
 
@@ -88,13 +114,20 @@ class Project(models.Model):
     def is_private(self):
         return self.private
 
+    def get_counters(self):
+        try:
+            return self.counters
+        except ProjectCounters.DoesNotExist:
+            ProjectCounters.refresh([self.id])
+            return ProjectCounters.objects.get(project=self)
+
     @property
     def quantity(self):
-        return self.task_set.count()
+        return self.get_counters().total_tasks
 
     @property
     def copies(self):
-        return self.contribution_set.count()
+        return self.get_counters().total_copies
 
     @property
     def project_status(self):
@@ -114,17 +147,16 @@ class Project(models.Model):
 
     @property
     def progress(self):
-        if self.copies != 0:
-            total = self.copies
-            completed = self.contribution_set.filter(submitted=True).count()
-            return '%d%%' % (completed/total*100)
+        counters = self.get_counters()
+        if counters.total_copies != 0:
+            return '%d%%' % (counters.submitted_copies/counters.total_copies*100)
         return '0%'
 
     @property
     def is_done(self):
-        if self.task_set.filter(label=''):
-            return False
-        return True
+        counters = self.get_counters()
+        counters.refresh_from_db()
+        return counters.labelled_tasks >= counters.total_tasks
 
     def update_contributors(self):
         for contributor in self.contributors.all():
@@ -135,8 +167,73 @@ class Project(models.Model):
             self.contributors.add(contributor)
 
 
+class ProjectCounters(models.Model):
+    """
+    Progress counters of a project, kept in their own row so that saving a
+    Project never writes back stale values. They are moved with F() updates
+    where tasks, contributions and inspections change state; `refresh`
+    recomputes them from scratch.
+    """
+    project = models.OneToOneField(Project, related_name='counters')
+    total_tasks = models.IntegerField(default=0)
+    total_copies = models.IntegerField(default=0)
+    submitted_copies = models.IntegerField(default=0)
+    labelled_tasks = models.IntegerField(default=0)
+    open_inspections = models.IntegerField(default=0)
+
+    FIELDS = ('total_tasks', 'total_copies', 'submitted_copies', 'labelled_tasks', 'open_inspections')
+
+    def __str__(self):
+        return str(self.project) + '_counters'
+
+    @classmethod
+    def bump(cls, project_id, **deltas):
+        updated = cls.objects.filter(project_id=project_id).update(
+            **{field: F(field) + delta for field, delta in deltas.items()}
+        )
+        if not updated:
+            cls.refresh([project_id])
+
+    @classmethod
+    def reset(cls, project_id):
+        cls.objects.filter(project_id=project_id).update(**dict.fromkeys(cls.FIELDS, 0))
+
+    @classmethod
+    def refresh(cls, project_ids=None):
+        projects = Project.objects.all()
+        if project_ids is not None:
+            projects = projects.filter(id__in=project_ids)
+        values = {project_id: dict.fromkeys(cls.FIELDS, 0) for project_id in projects.values_list('id', flat=True)}
+        aggregates = [
+            projects.annotate(
+                total_tasks=Count('task'),
+                labelled_tasks=Count(Case(When(task__label__gt='', then='task__id'))),
+            ).values('id', 'total_tasks', 'labelled_tasks'),
+            projects.annotate(
+                total_copies=Count('contribution'),
+                submitted_copies=Count(Case(When(contribution__submitted=True, then='contribution__id'))),
+            ).values('id', 'total_copies', 'submitted_copies'),
+            projects.annotate(
+                open_inspections=Count(Case(When(inspection__submitted=False, then='inspection__id'))),
+            ).values('id', 'open_inspections'),
+        ]
+        for aggregate in aggregates:
+            for row in aggregate.order_by():
+                values[row.pop('id')].update(row)
+        existing = set(cls.objects.filter(project_id__in=values).values_list('project_id', flat=True))
+        with transaction.atomic():
+            for project_id in existing:
+                cls.objects.filter(project_id=project_id).update(**values[project_id])
+            cls.objects.bulk_create(
+                [cls(project_id=project_id, **row) for project_id, row in values.items() if project_id not in existing]
+            )
+        return len(values)
+
+
 @receiver(post_save, sender=Project)
-def project_updated_receiver(sender, instance, *args, **kwargs):
+def project_updated_receiver(sender, instance, created, *args, **kwargs):
+    if created:
+        ProjectCounters.objects.get_or_create(project=instance)
     instance.update_contributors()
 
 
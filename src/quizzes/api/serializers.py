@@ -1,11 +1,10 @@
-import csv
-
 from rest_framework import serializers
 
 from quizzes.models import Quiz, Question, Answer, QuizContributor, QuestionType
 from targets.api.serializers import TargetSerializer, TargetTypeSerializer
 from tags.api.serializers import TagBriefSerializer
-from annotation.utils import get_filename_ext
+from annotation.content import get_text_content
+from annotation.navigation import neighbour_ids
 from projects.api.serializers import ProjectQuizSerializer
 
 
@@ -84,16 +83,7 @@ class QuestionSerializer(serializers.ModelSerializer):
         read_only_fields = ['quiz', 'label']
 
     def get_text_content(self, obj):
-        path = obj.file_path
-        name, ext = get_filename_ext(path)
-        if ext == '.csv':
-            reader = csv.DictReader(open(path, encoding='utf-8'))
-            for i, row in enumerate(reader):
-                if i == 0:
-                    content = row
-        else:
-            content = ''
-        return content
+        return get_text_content(obj, text_files=False)
 
 
 class AnswerSerializer(serializers.ModelSerializer):
@@ -126,16 +116,7 @@ class AnswerSerializer(serializers.ModelSerializer):
         return TargetSerializer(target).data
 
     def get_text_content(self, obj):
-        path = obj.question.file_path
-        name, ext = get_filename_ext(path)
-        if ext == '.csv':
-            reader = csv.DictReader(open(path, encoding='utf-8'))
-            for i, row in enumerate(reader):
-                if i == 0:
-                    content = row
-        else:
-            content = ''
-        return content
+        return get_text_content(obj.question, text_files=False)
 
 
 class QuizRecordSerializer(serializers.ModelSerializer):
@@ -211,31 +192,16 @@ class AnswerUpdateSerializer(serializers.ModelSerializer):
         return TargetSerializer(target).data
 
     def get_text_content(self, obj):
-        path = obj.question.file_path
-        name, ext = get_filename_ext(path)
-        if ext == '.csv':
-            reader = csv.DictReader(open(path, encoding='utf-8'))
-            for i, row in enumerate(reader):
-                if i == 0:
-                    content = row
-        else:
-            content = ''
-        return content
+        return get_text_content(obj.question, text_files=False)
 
     def get_previous_id(self, obj):
-        if obj.quiz_contributor:
-            my_quiz = Answer.objects.filter(quiz_contributor=obj.quiz_contributor)
-            previous = my_quiz.filter(created__lt=obj.created).order_by('-created').first()
-            if previous:
-                return previous.id
+        if obj.quiz_contributor_id:
+            return neighbour_ids(obj, ('quiz_contributor',))[0]
         return None
 
     def get_next_id(self, obj):
-        if obj.quiz_contributor:
-            my_quiz = Answer.objects.filter(quiz_contributor=obj.quiz_contributor)
-            previous = my_quiz.filter(created__gt=obj.created).order_by('created').first()
-            if previous:
-                return previous.id
+        if obj.quiz_contributor_id:
+            return neighbour_ids(obj, ('quiz_contributor',))[1]
         return None
 
 
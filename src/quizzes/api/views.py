@@ -1,11 +1,16 @@
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import transaction
 from rest_framework.response import Response
 from rest_framework import generics, mixins, permissions
 
 from django.http import HttpResponse
 import csv
 from django.utils.encoding import escape_uri_path
+from annotation.payloads import PayloadStore
+from annotation.content import invalidate_text_content
 from quizzes.models import Quiz, QuizContributor, Answer, QuestionType, QuizStatus
+from quizzes.tasks import compact_ordinals
 from .serializers import (
     QuizSerializer,
     QuestionSerializer,
@@ -67,6 +72,8 @@ class QuizAPIDetailView(generics.RetrieveAPIView, mixins.UpdateModelMixin, mixin
             quiz = get_object_or_404(Quiz, id=quiz_id)
             question = quiz.question_set.all()
             question.delete()
+            PayloadStore('quizzes', quiz.id).clear()
+            invalidate_text_content('quizzes', quiz.id)
         return self.update(request, *args, **kwargs)
 
     def delete(self, request, *args, **kwargs):
@@ -107,11 +114,12 @@ class QuestionAPIView(generics.ListAPIView):
 
     search_fields = ()
     ordering_fields = ()
+    cursor_ordering = ('ordinal', 'id')
 
     def get_queryset(self, *args, **kwargs):
         quiz_id = self.kwargs.get("id", None)
         quiz = get_object_or_404(Quiz, id=quiz_id, founder=self.request.user)
-        return quiz.question_set.all()
+        return quiz.question_set.select_related('quiz__quiz_type').order_by('ordinal', 'id')
 
     def put(self, request, *args, **kwargs):
         quiz_id = self.kwargs.get("id", None)
@@ -121,6 +129,7 @@ class QuestionAPIView(generics.ListAPIView):
             questions = quiz.question_set.all()
             question = get_object_or_404(questions, id=question_id)
             question.delete()
+            transaction.on_commit(lambda: compact_ordinals.delay(quiz.id))
             return self.get(request, *args, **kwargs)
         else:
             return Response({"message": "Question_id should not be empty"}, status=400)
@@ -140,15 +149,18 @@ class QuestionDownloadAPIView(generics.ListAPIView):
         return self.download_file(quiz)
 
     def download_file(self, instance):
-        queryset = instance.question_set.all()
+        queryset = instance.question_set.order_by('ordinal', 'id')
         response = HttpResponse(content_type='text/csv')
         name = '%s_%s_%s.csv' % (instance.id, instance.name, instance.quiz_type)
         response['Content-Disposition'] = "attachment; filename*=utf-8''{}".format(escape_uri_path(name))
         print(response['Content-Disposition'])
         writer = csv.writer(response)
         for i, obj in enumerate(queryset):
-            path = obj.file_path
-            reader = csv.reader(open(path, encoding='utf-8'))
+            row = obj.load_payload()
+            if row is not None:
+                reader = [list(row.keys()), list(row.values())]
+            else:
+                reader = csv.reader(open(obj.file_path, encoding='utf-8'))
             if i == 0:
                 for j, row in enumerate(reader):
                     if j == 0:
@@ -185,6 +197,8 @@ class AnswerAPIView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
         quiz_id = self.kwargs.get("id", None)
         user = self.request.user
         qc = QuizContributor.objects.get(quiz_id=quiz_id, contributor=user)
+        if settings.QUIZ_LAZY_ANSWERS:
+            return qc.next_answer()
         spare_set = Answer.objects.filter(quiz_contributor=qc, label='')
         if spare_set:
             return spare_set.first()
@@ -212,6 +226,11 @@ class AnswerAPIView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
         instance = self.get_object()
         if instance:
             if request.data['label']:
+                if instance.pk is None:
+                    # A lazy answer is created on its first label; a concurrent submit gets the same row.
+                    instance, created = Answer.objects.get_or_create(
+                        quiz_contributor=instance.quiz_contributor, question=instance.question
+                    )
                 instance.label = request.data['label']
                 if not instance.created:
                     instance.created = timezone.now()
@@ -313,19 +332,16 @@ class QuestionSubmitAPIView(generics.RetrieveAPIView):
     def put(self, request, *args, **kwargs):
         quiz_id = self.kwargs.get("id", None)
         qc = QuizContributor.objects.get(quiz_id=quiz_id, contributor_id=request.user)
-        if qc.status == QuizStatus(pk='answering'):
-            if qc.is_completed:
+        if qc.status_id == 'answering':
+            totals = qc.answer_totals()
+            if not totals['unanswered']:
                 qc.status = QuizStatus(pk='submitted')
                 if not qc.accuracy:
-                    good_answer = 0
-                    for answer in Answer.objects.filter(quiz_contributor=qc):
-                        if answer.label == answer.question.label:
-                            good_answer += 1
-                    qc.accuracy = good_answer / qc.quantity
+                    qc.accuracy = totals['good'] / totals['total'] if totals['total'] else 0
                 qc.save()
                 return self.get(request, *args, **kwargs)
             else:
-                uncompleted = Answer.objects.filter(quiz_contributor=qc, label='').count()
+                uncompleted = totals['unanswered']
                 return Response({"message": "%s questions remain unanswered,Can't be submitted" % uncompleted}, status=400)
         else:
             return self.get(request, *args, **kwargs)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from quizzes.models import Question, compact_question_ordinals
+
+
+class Command(BaseCommand):
+    help = 'Number the questions of quizzes created before questions had ordinals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        questions = Question.objects.filter(ordinal__isnull=True)
+        if options['quiz_ids']:
+            questions = questions.filter(quiz_id__in=options['quiz_ids'])
+        quiz_ids = questions.order_by().values_list('quiz_id', flat=True).distinct()
+        count = 0
+        for quiz_id in list(quiz_ids):
+            compact_question_ordinals(quiz_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Numbered the questions of %d quizzes.' % count))
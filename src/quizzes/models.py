@@ -1,15 +1,17 @@
 import os
 import csv
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Max, Case, When, Value, F, Q, Exists, OuterRef
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.storage import FileSystemStorage
 from django.dispatch import receiver
 from django.db.models.signals import post_save
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-from annotation.utils import get_filename_ext, random_string_generator
+from annotation.utils import get_filename_ext
+from annotation.storage import ContentAddressedStorage
+from annotation.payloads import PayloadStore
 from targets.models import Target, TargetType
 from tags.models import Tag
 
@@ -18,13 +20,9 @@ User = get_user_model()
 
 
 def upload_quiz_file_path(instance, filename):
+    # ContentAddressedStorage names the file after its content, only the extension is kept.
     name, ext = get_filename_ext(filename)
-    while True:
-        new_filename = random_string_generator()
-        if new_filename not in os.listdir(settings.MEDIA_ROOT):
-            break
-    final_filename = '{new_filename}{ext}'.format(new_filename=new_filename, ext=ext)
-    return final_filename
+    return 'upload{ext}'.format(ext=ext)
 
 
 class QuestionType(models.Model):
@@ -56,13 +54,13 @@ class Quiz(models.Model):
     quiz_target = models.ForeignKey(Target, related_name='target_quizzes')
     quiz_file = models.FileField(
         upload_to=upload_quiz_file_path,
-        storage=FileSystemStorage(location=settings.QUIZ_ROOT, base_url=settings.QUIZ_URL),
+        storage=ContentAddressedStorage(location=settings.QUIZ_ROOT, base_url=settings.QUIZ_URL),
         blank=True,
         null=True,
     )
     label_file = models.FileField(
         upload_to=upload_quiz_file_path,
-        storage=FileSystemStorage(location=settings.LABEL_ROOT, base_url=settings.LABEL_URL),
+        storage=ContentAddressedStorage(location=settings.LABEL_ROOT, base_url=settings.LABEL_URL),
         blank=True,
         null=True,
     )
@@ -97,15 +95,32 @@ class Quiz(models.Model):
 
 class Question(models.Model):
     quiz = models.ForeignKey(Quiz)
-    file_path = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=255, blank=True)
+    payload = models.TextField(blank=True)
+    payload_index = models.IntegerField(blank=True, null=True)
     label = models.CharField(max_length=255, blank=True)
+    ordinal = models.IntegerField(blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['quiz', 'ordinal']),
+        ]
+
     def __str__(self):
         return str(self.id) + '_' + self.quiz.name
 
+    @property
+    def payload_store(self):
+        return PayloadStore('quizzes', self.quiz_id)
+
+    def load_payload(self):
+        return self.payload_store.load(self.payload, self.payload_index)
+
     @property
     def qid(self):
+        if self.ordinal is not None:
+            return self.ordinal
         quiz = self.quiz
         question_id_list = quiz.question_set.all().values_list('id', flat=True)
         question_id = list(question_id_list).index(self.id)
@@ -136,27 +151,51 @@ class QuizContributor(models.Model):
 
     @property
     def quantity(self):
-        return self.answer_set.count()
+        return self.answer_totals()['total']
 
     @property
     def is_completed(self):
-        if self.answer_set.filter(label=''):
-            return False
-        return True
+        return not self.answer_totals()['unanswered']
 
     @property
     def progress(self):
-        num_of_answers = self.answer_set.count()
-        completed = self.answer_set.exclude(label='').count()
-        try:
-            return '%d%%' % (completed/num_of_answers*100)
-        except:
-            return '0%'
+        totals = self.answer_totals()
+        if totals['total']:
+            return '%d%%' % (totals['answered']/totals['total']*100)
+        return '0%'
 
     @property
     def status_name(self):
         return self.status.quiz_status_name
 
+    def answer_totals(self):
+        """
+        Counts all, answered, unanswered and correct answers of this contributor in one query.
+        With QUIZ_LAZY_ANSWERS only given answers have rows, so the total is the number of questions.
+        """
+        # Questions are counted, not rows, so a duplicated answer can never stand in for a missing one.
+        totals = self.answer_set.aggregate(
+            answers=Count('question', distinct=True),
+            answered=Count(Case(When(~Q(label=''), then='question')), distinct=True),
+            good=Count(Case(When(label=F('question__label'), then='question')), distinct=True),
+        )
+        totals = {key: value or 0 for key, value in totals.items()}
+        totals['total'] = self.quiz.question_set.count() if settings.QUIZ_LAZY_ANSWERS else totals['answers']
+        totals['unanswered'] = max(totals['total'] - totals['answered'], 0)
+        return totals
+
+    def next_answer(self):
+        """
+        The answer to the first question not labelled yet, unsaved unless a blank row already exists.
+        Unanswered questions are found with an anti-join, so no blank answers need to be created up front.
+        """
+        labelled = Answer.objects.filter(quiz_contributor=self, question=OuterRef('pk')).exclude(label='')
+        question = self.quiz.question_set.annotate(labelled=Exists(labelled)).filter(labelled=False)\
+            .order_by('ordinal', 'id').first()
+        if question is None:
+            return None
+        return self.answer_set.filter(question=question).first() or Answer(quiz_contributor=self, question=question)
+
 
 class Answer(models.Model):
     question = models.ForeignKey(Question)
@@ -166,34 +205,72 @@ class Answer(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     created = models.DateTimeField(null=True)
 
+    class Meta:
+        unique_together = ('quiz_contributor', 'question')
+        indexes = [
+            models.Index(fields=['quiz_contributor', 'created']),
+        ]
+
 
 def create_questions(instance):
     name, ext = get_filename_ext(instance.quiz_file.name)
     quiz_file_path = os.path.join(settings.QUIZ_ROOT, instance.quiz_file.name)
-    quiz_file_dir = os.path.join(settings.QUIZ_ROOT, name)
     label_file_path = os.path.join(settings.LABEL_ROOT, instance.label_file.name)
-    os.mkdir(quiz_file_dir)
 
     if ext == '.csv':
-        inner_dir_name = '%s' % instance.name
-        quiz_file_dir = os.path.join(quiz_file_dir, inner_dir_name)
-        os.mkdir(quiz_file_dir)
-        quiz_reader = csv.DictReader(open(quiz_file_path, encoding='utf-8'))
-        label_reader = csv.DictReader(open(label_file_path, encoding='utf-8'))
-
-        for (quiz_row, label_row) in zip(quiz_reader, label_reader):
-            if quiz_row['\ufeffid'] == label_row['\ufeffid']:
-                file_name = '%s.csv' % quiz_row['\ufeffid']
-                final_quiz_file_path = os.path.join(quiz_file_dir, file_name)
-                f = open(final_quiz_file_path, 'w', newline='', encoding='utf-8')
-                writer = csv.DictWriter(f, dialect='excel', fieldnames=quiz_reader.fieldnames)
-                writer.writeheader()
-                writer.writerow(quiz_row)
-                Question.objects.create(
-                    quiz=instance,
-                    file_path=final_quiz_file_path,
-                    label=label_row['label'],
-                )
+        with open(quiz_file_path, encoding='utf-8') as quiz_file, open(label_file_path, encoding='utf-8') as label_file:
+            quiz_reader = csv.DictReader(quiz_file)
+            label_reader = csv.DictReader(label_file)
+
+            rows = [
+                (quiz_row, label_row['label'])
+                for (quiz_row, label_row) in zip(quiz_reader, label_reader)
+                if quiz_row['\ufeffid'] == label_row['\ufeffid']
+            ]
+
+        stored = PayloadStore('quizzes', instance.id).save([quiz_row for quiz_row, label in rows])
+        last = instance.question_set.aggregate(last=Max('ordinal'))['last'] or 0
+        Question.objects.bulk_create(
+            [
+                Question(quiz=instance, label=label, ordinal=last + i, **fields)
+                for i, ((quiz_row, label), fields) in enumerate(zip(rows, stored), 1)
+            ],
+            batch_size=1000,
+        )
+
+
+def compact_question_ordinals(quiz_id, batch_size=1000):
+    """
+    Closes the gaps deleted questions leave in a quiz's ordinals.
+
+    Only the ordinals are read; every run of questions between two gaps is
+    shifted down with a single F() update, lowest run first. Questions made
+    before ordinals existed have none; they are older than every numbered one,
+    so they are numbered first, in id order, and the rest move up behind them.
+    """
+    with transaction.atomic():
+        questions = Question.objects.filter(quiz_id=quiz_id)
+        ordinals = questions.filter(ordinal__isnull=False).order_by('ordinal').values_list('ordinal', flat=True)
+        shift, expected, runs = 0, 1, []
+        for ordinal in ordinals:
+            if ordinal != expected + shift:
+                shift = ordinal - expected
+                runs.append([ordinal, ordinal, shift])
+            elif runs:
+                runs[-1][1] = ordinal
+            expected += 1
+        for first, last, shift in runs:
+            questions.filter(ordinal__gte=first, ordinal__lte=last).update(ordinal=F('ordinal') - shift)
+        unnumbered = list(questions.filter(ordinal__isnull=True).order_by('id').values_list('id', flat=True))
+        if unnumbered:
+            questions.filter(ordinal__isnull=False).update(ordinal=F('ordinal') + len(unnumbered))
+            for i in range(0, len(unnumbered), batch_size):
+                ids = unnumbered[i:i + batch_size]
+                questions.filter(id__in=ids).update(ordinal=Case(
+                    *[When(id=question_id, then=Value(i + n)) for n, question_id in enumerate(ids, 1)],
+                    output_field=models.IntegerField()
+                ))
+    return len(runs) + len(unnumbered)
 
 
 @receiver(post_save, sender=Quiz)
@@ -204,8 +281,11 @@ def create_questions_receiver(sender, instance, *args, **kwargs):
 
 @receiver(post_save, sender=QuizContributor)
 def create_answers_receiver(sender, instance, created, *args, **kwargs):
-    if created:
-        for question in instance.quiz.question_set.all():
-            Answer.objects.create(quiz_contributor=instance, question=question)
+    if created and not settings.QUIZ_LAZY_ANSWERS:
+        question_ids = instance.quiz.question_set.values_list('id', flat=True)
+        Answer.objects.bulk_create(
+            [Answer(quiz_contributor=instance, question_id=question_id) for question_id in question_ids],
+            batch_size=1000,
+        )
 
 
@@ -0,0 +1,8 @@
+from celery import task
+
+
+@task(name='quizzes.tasks.compact_ordinals', acks_late=True)
+def compact_ordinals(quiz_id):
+    from quizzes.models import compact_question_ordinals
+
+    compact_question_ordinals(quiz_id)
@@ -41,7 +41,7 @@ class Tag(models.Model):
         tag_project = self.tagged_projects.all()
         if tag_project:
             return False
-        child = Tag.objects.filter(parent=self.id)
+        child = self.child_tags.all()
         if child:
             return False
         return True
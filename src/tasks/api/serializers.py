@@ -1,10 +1,9 @@
-import csv
-
 from rest_framework import serializers
 
-from tasks.models import Task, Contribution, Inspection
+from tasks.models import Task, Contribution, Inspection, IngestJob, ResultFileJob
 from targets.api.serializers import TargetSerializer
-from annotation.utils import get_filename_ext
+from annotation.content import get_text_content
+from annotation.navigation import neighbour_ids
 
 
 class TaskContributeSerializer(serializers.ModelSerializer):
@@ -43,17 +42,7 @@ class TaskContributeSerializer(serializers.ModelSerializer):
         return TargetSerializer(target).data
 
     def get_text_content(self, obj):
-        path = obj.task.file_path
-        name, ext = get_filename_ext(path)
-        if ext == '.csv':
-            reader = csv.DictReader(open(path, encoding='utf-8'))
-            for i, row in enumerate(reader):
-                if i == 0:
-                    content = row
-        else:
-            with open(path, 'r', encoding='utf-8') as file:
-                content = file.read().strip()
-        return content
+        return get_text_content(obj.task)
 
     def get_contributor_name(self, obj):
         if obj.contributor:
@@ -61,22 +50,41 @@ class TaskContributeSerializer(serializers.ModelSerializer):
         return None
 
     def get_previous_id(self, obj):
-        if obj.contributor:
-            my_tasks = Contribution.objects.filter(project=obj.project, contributor=obj.contributor)
-            previous = my_tasks.filter(created__lt=obj.created).order_by('-created').first()
-            if previous:
-                return previous.id
+        if obj.contributor_id:
+            return neighbour_ids(obj, ('project', 'contributor'))[0]
         return None
 
     def get_next_id(self, obj):
-        if obj.contributor:
-            my_tasks = Contribution.objects.filter(project=obj.project, contributor=obj.contributor)
-            next_task = my_tasks.filter(created__gt=obj.created).order_by('created').first()
-            if next_task:
-                return next_task.id
+        if obj.contributor_id:
+            return neighbour_ids(obj, ('project', 'contributor'))[1]
         return None
 
 
+class CheckoutLabelSerializer(serializers.Serializer):
+    contribution_id = serializers.IntegerField()
+    label = serializers.CharField(max_length=255)
+
+
+class TaskCheckoutSerializer(serializers.ModelSerializer):
+    text_content = serializers.SerializerMethodField(read_only=True)
+    labels = CheckoutLabelSerializer(many=True, write_only=True, allow_empty=False)
+    submitted = serializers.BooleanField(write_only=True, required=False, default=False)
+
+    class Meta:
+        model = Contribution
+        fields = [
+            'id',
+            'text_content',
+            'lease_expires',
+            'labels',
+            'submitted',
+        ]
+        read_only_fields = ['id', 'lease_expires']
+
+    def get_text_content(self, obj):
+        return get_text_content(obj.task)
+
+
 class TaskContributeUpdateSerializer(TaskContributeSerializer):
     class Meta:
         model = Contribution
@@ -127,17 +135,7 @@ class TaskInspectSerializer(serializers.ModelSerializer):
         return TargetSerializer(target).data
 
     def get_text_content(self, obj):
-        path = obj.task.file_path
-        name, ext = get_filename_ext(path)
-        if ext == '.csv':
-            reader = csv.DictReader(open(path, encoding='utf-8'))
-            for i, row in enumerate(reader):
-                if i == 0:
-                    content = row
-        else:
-            with open(path, 'r', encoding='utf-8') as file:
-                content = file.read().strip()
-        return content
+        return get_text_content(obj.task)
 
     def get_inspector_name(self, obj):
         try:
@@ -215,17 +213,7 @@ class TaskResultSerializer(serializers.ModelSerializer):
         ]
 
     def get_text_content(self, obj):
-        path = obj.file_path
-        name, ext = get_filename_ext(path)
-        if ext == '.csv':
-            reader = csv.DictReader(open(path, encoding='utf-8'))
-            for i, row in enumerate(reader):
-                if i == 0:
-                    content = row
-        else:
-            with open(path, 'r', encoding='utf-8') as file:
-                content = file.read().strip()
-        return content
+        return get_text_content(obj)
 
     def get_inspection(self, obj):
         try:
@@ -252,4 +240,39 @@ class TaskInspectUpdateSerializer(TaskInspectSerializer):
             'label',
             'submitted',
         ]
-        read_only_fields = ['id', 'inspector', 'created']
\ No newline at end of file
+        read_only_fields = ['id', 'inspector', 'created']
+
+
+class IngestJobSerializer(serializers.ModelSerializer):
+    eta = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = IngestJob
+        fields = [
+            'project',
+            'state',
+            'rows_parsed',
+            'rows_inserted',
+            'bytes_read',
+            'bytes_total',
+            'eta',
+            'error',
+            'started',
+            'updated',
+        ]
+        read_only_fields = fields
+
+    def get_eta(self, obj):
+        return obj.eta
+
+
+class ResultFileJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ResultFileJob
+        fields = [
+            'state',
+            'error',
+            'started',
+            'updated',
+        ]
+        read_only_fields = fields
@@ -1,5 +1,5 @@
-import random
-
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 import django.utils.timezone as timezone
 
@@ -8,12 +8,31 @@ from rest_framework import generics, mixins, permissions
 
 from projects.models import Project, Status
 from tasks.models import Task, Contribution, Inspection
+from tasks.assignment import lease_contribution, lease_contributions
 from quizzes.models import QuizContributor
+from targets.api.serializers import TargetSerializer
 from .serializers import TaskContributeSerializer, TaskInspectSerializer, TaskContributeUpdateSerializer, \
-    TaskInspectUpdateSerializer
+    TaskInspectUpdateSerializer, TaskCheckoutSerializer
 from accounts.api.permissions import IsContributorOrReadOnly, HasContributed, IsInspectorOrReadOnly, HasInspected
 
 
+def check_contribute_gate(project, user):
+    # Handing out work leases contributions, so even these GETs are for contributors only.
+    if not project.contributors.filter(id=user.id).exists():
+        return Response({"message": "You must be the contributor of this content to change."}, status=400)
+    if project.verify_status != 'passed':
+        return Response({"message": "Project hasn't passed the verification yet."}, status=400)
+    if project.quiz:
+        qc = QuizContributor.objects.filter(quiz=project.quiz, contributor=user).first()
+        if qc is None:
+            return Response({"message": "Please do the quiz first."}, status=400)
+        if not qc.is_completed:
+            return Response({"message": "You have not finished the quiz yet."}, status=400)
+        if qc.accuracy < project.accuracy_requirement:
+            return Response({"message": "You have failed the quiz."}, status=400)
+    return None
+
+
 class TaskContributeView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
     """
     get:
@@ -30,30 +49,14 @@ class TaskContributeView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
 
     def get_object(self, *args, **kwargs):
         project_id = self.kwargs.get("id", None)
-        user = self.request.user
-        user_con_set = Contribution.objects.filter(project=project_id, contributor=user)
-        tasks = user_con_set.values_list('task', flat=True)
-        spare_set = Contribution.objects.filter(project=project_id, label='').exclude(task__in=tasks)
-        if spare_set:
-            ids = spare_set.values_list('id', flat=True)
-            rand_id = random.sample(list(ids), 1)[0]
-            return spare_set.get(id=rand_id)
-        return Contribution.objects.none().first()
+        return lease_contribution(project_id, self.request.user)
 
     def get(self, request, *args, **kwargs):
         project_id = self.kwargs.get("id", None)
         project = get_object_or_404(Project, id=project_id)
-        if project.verify_status != 'passed':
-            return Response({"message": "Project hasn't passed the verification yet."}, status=400)
-        if project.quiz:
-            user = request.user
-            if user not in project.quiz.contributors.all():
-                return Response({"message": "Please do the quiz first."}, status=400)
-            qc = QuizContributor.objects.get(quiz=project.quiz, contributor=user)
-            if not qc.is_completed:
-                return Response({"message": "You have not finished the quiz yet."}, status=400)
-            if qc.accuracy < project.accuracy_requirement:
-                return Response({"message": "You have failed the quiz."}, status=400)
+        gate = check_contribute_gate(project, request.user)
+        if gate:
+            return gate
         instance = self.get_object()
         if instance:
             serializer = self.get_serializer(instance)
@@ -64,6 +67,8 @@ class TaskContributeView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
         if request.data['label']:
             contribution_id = request.data.get("contribution_id")
             instance = get_object_or_404(Contribution, id=contribution_id)
+            if instance.is_leased_to_other(request.user):
+                return Response({"message": "This contribution is assigned to someone else."}, status=400)
             instance.label = request.data['label']
             instance.contributor = request.user
             try:
@@ -80,6 +85,86 @@ class TaskContributeView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
         return self.put(request, *args, **kwargs)
 
 
+class TaskCheckoutView(generics.GenericAPIView):
+    """
+    get:
+        【标注任务】 一次领取多道该用户未解答的问题（size指定数量）
+
+    put:
+        【标注任务】 批量答题，labels为[{"contribution_id": id, "label": label}]，在一个事务中提交；
+        只接受自己领取或已答过的问题，同一任务只能答一份，其余计入rejected
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = TaskCheckoutSerializer
+
+    def get_size(self):
+        try:
+            size = int(self.request.query_params.get('size', settings.CHECKOUT_DEFAULT_SIZE))
+        except ValueError:
+            size = settings.CHECKOUT_DEFAULT_SIZE
+        return max(1, min(size, settings.CHECKOUT_MAX_SIZE))
+
+    def get(self, request, *args, **kwargs):
+        project_id = self.kwargs.get("id", None)
+        project = get_object_or_404(
+            Project.objects.select_related('status', 'project_type', 'project_target__type'), id=project_id
+        )
+        gate = check_contribute_gate(project, request.user)
+        if gate:
+            return gate
+        held = lease_contributions(project.id, request.user, self.get_size())
+        if not held:
+            return Response({"message": "Contribution Completed"}, status=200)
+        held = Contribution.objects.filter(id__in=[c.id for c in held]).select_related('task').order_by('id')
+        return Response({
+            "project_type": project.project_type.name,
+            "target": TargetSerializer(project.project_target).data,
+            "results": self.get_serializer(held, many=True).data,
+        })
+
+    def put(self, request, *args, **kwargs):
+        project_id = self.kwargs.get("id", None)
+        project = get_object_or_404(Project, id=project_id)
+        user = request.user
+        gate = check_contribute_gate(project, user)
+        if gate:
+            return gate
+        if project.project_status != 'answering':
+            return Response({"message": "Not allowed to check."}, status=400)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        labels = {item['contribution_id']: item['label'] for item in serializer.validated_data['labels']}
+        submitted = serializer.validated_data['submitted']
+        rejected = []
+        updated = 0
+        with transaction.atomic():
+            contributions = project.contribution_set.select_for_update().select_related('project', 'task')\
+                .filter(id__in=labels).order_by('id')
+            # One person labels at most one copy of a task, otherwise their votes alone would decide it.
+            batch_tasks = project.contribution_set.filter(id__in=labels).values('task')
+            labelled_tasks = set(
+                project.contribution_set.filter(contributor=user, task__in=batch_tasks)
+                .exclude(id__in=labels).values_list('task', flat=True)
+            )
+            for instance in contributions:
+                mine = instance.contributor_id == user.id or (
+                    instance.contributor_id is None and instance.leased_to_id == user.id
+                )
+                if not mine or instance.task_id in labelled_tasks:
+                    rejected.append(instance.id)
+                    continue
+                labelled_tasks.add(instance.task_id)
+                instance.label = labels[instance.id]
+                instance.contributor = user
+                if submitted:
+                    instance.submitted = True
+                if not instance.created:
+                    instance.created = timezone.now()
+                instance.save()
+                updated += 1
+        return Response({"updated": updated, "rejected": rejected}, status=200)
+
+
 class TaskInspectView(generics.RetrieveAPIView, mixins.UpdateModelMixin):
     """
     get:
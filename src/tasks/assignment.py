@@ -0,0 +1,85 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from tasks.models import Contribution
+
+
+ASSIGNMENT_CANDIDATES = 20
+
+
+def is_free(now):
+    return Q(lease_expires__isnull=True) | Q(lease_expires__lte=now)
+
+
+def release(contribution_id, user):
+    Contribution.objects.filter(id=contribution_id, leased_to=user, label='').update(
+        leased_to=None, lease_expires=None
+    )
+
+
+def lease_contributions(project_id, user, size=1):
+    """
+    Hands out up to `size` unlabelled contributions of a project to `user`.
+
+    A contribution is claimed with a conditional UPDATE that only succeeds while
+    its lease is free or expired, so concurrent requests can never both win the
+    same row and no row lock is held. Leases the user already holds are handed
+    back first, and a claim is undone when it would give the user a second copy
+    of a task they already hold or have labelled.
+    """
+    now = timezone.now()
+    expires = now + timedelta(seconds=settings.CONTRIBUTION_LEASE_SECONDS)
+    project_set = Contribution.objects.filter(project=project_id)
+
+    held = list(
+        project_set.filter(leased_to=user, label='', lease_expires__gt=now).order_by('id')[:size]
+    )
+    if held:
+        project_set.filter(id__in=[c.id for c in held]).update(lease_expires=expires)
+
+    attempts = 0
+    while len(held) < size and attempts < 3:
+        attempts += 1
+        taken = project_set.filter(
+            Q(contributor=user) | Q(leased_to=user, lease_expires__gt=now)
+        ).values('task')
+        # Walks the (project, label, id) index in id order and stops at the limit; the lease
+        # check is a filter on the rows of that walk, so no free row set is ever sorted.
+        candidates = list(
+            project_set.filter(is_free(now), label='').exclude(task__in=taken)
+            .order_by('id').values_list('id', 'task')[:ASSIGNMENT_CANDIDATES + size]
+        )
+        if not candidates:
+            break
+        random.shuffle(candidates)
+        held_tasks = set(c.task_id for c in held)
+        for contribution_id, task_id in candidates:
+            if len(held) >= size:
+                break
+            if task_id in held_tasks:
+                continue
+            claimed = project_set.filter(is_free(now), id=contribution_id, label='').update(
+                leased_to=user, lease_expires=expires
+            )
+            if not claimed:
+                continue
+            duplicate = project_set.filter(task=task_id).exclude(id=contribution_id).filter(
+                Q(contributor=user) | Q(leased_to=user, lease_expires__gt=now)
+            ).exists()
+            if duplicate:
+                release(contribution_id, user)
+                continue
+            held.append(Contribution.objects.get(id=contribution_id))
+            held_tasks.add(task_id)
+    return held
+
+
+def lease_contribution(project_id, user):
+    held = lease_contributions(project_id, user, 1)
+    if held:
+        return held[0]
+    return None
@@ -0,0 +1,309 @@
+import io
+import os
+import csv
+import zlib
+import logging
+import tempfile
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from annotation.utils import get_filename_ext
+from annotation.payloads import dump_row
+from projects.models import Project
+
+
+logger = logging.getLogger(__name__)
+
+
+def iter_tasks(project, chunk_size=None, since=None, until=None):
+    """
+    Yields the tasks of a project in id order or, when a `since`/`until` window
+    on Task.updated is given, only the tasks changed inside it in (updated, id) order.
+
+    Tasks are fetched in keyset-paginated chunks (rows after the last key seen),
+    so no query ever scans past an offset and at most one chunk is held in memory.
+    """
+    from tasks.models import Task
+
+    chunk_size = chunk_size or settings.RESULT_EXPORT_CHUNK_SIZE
+    queryset = Task.objects.filter(project=project)\
+        .only('id', 'project', 'file_path', 'payload', 'payload_index', 'label', 'updated')
+    delta = since is not None or until is not None
+    if since is not None:
+        queryset = queryset.filter(updated__gt=since)
+    if until is not None:
+        queryset = queryset.filter(updated__lte=until)
+    queryset = queryset.order_by('updated', 'id') if delta else queryset.order_by('id')
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None and delta:
+            chunk = chunk.filter(Q(updated__gt=last.updated) | Q(updated=last.updated, id__gt=last.id))
+        elif last is not None:
+            chunk = chunk.filter(id__gt=last.id)
+        count = 0
+        for task in chunk[:chunk_size].iterator():
+            count += 1
+            last = task
+            yield task
+        if count < chunk_size:
+            return
+
+
+def iter_result_rows(project, chunk_size=None, since=None, until=None):
+    delta = since is not None or until is not None
+    for task in iter_tasks(project, chunk_size, since, until):
+        row = task.load_payload()
+        if row is not None:
+            rows = [row]
+        elif get_filename_ext(task.file_path)[1] == '.csv':
+            with open(task.file_path, encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+        else:
+            rows = [OrderedDict([('file_name', os.path.basename(task.file_path))])]
+        for row in rows:
+            row['label'] = task.label
+            if delta:
+                # Delta rows replace earlier ones, so they carry the key to match them on.
+                row = OrderedDict([('task_id', task.id)] + list(row.items()))
+            yield row
+
+
+class Echo(object):
+    """A file-like object whose write just hands the value back, for csv writers feeding a generator."""
+
+    def write(self, value):
+        return value
+
+
+def iter_result_csv(rows):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    fieldnames = list(first)
+    writer = csv.DictWriter(Echo(), fieldnames=fieldnames, restval='', extrasaction='ignore')
+    yield writer.writerow(dict(zip(fieldnames, fieldnames)))
+    yield writer.writerow(first)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_result_jsonl(rows):
+    for row in rows:
+        yield dump_row(row) + '\n'
+
+
+def iter_blocks(lines, block_size=64 * 1024):
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= block_size:
+            yield ''.join(block)
+            block, size = [], 0
+    if block:
+        yield ''.join(block)
+
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def gzip_compressor():
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def zstd_compressor():
+    return zstandard.ZstdCompressor().compressobj()
+
+
+class ResultFormat(object):
+    """
+    One way of writing result rows out. `iter_chunks` turns rows into byte
+    chunks as they arrive, so a format never needs the whole result in memory.
+    """
+    name = None
+    extension = None
+    content_type = 'application/octet-stream'
+
+    def iter_chunks(self, rows):
+        raise NotImplementedError
+
+
+class LineResultFormat(ResultFormat):
+    def __init__(self, name, iter_lines, content_type, compressor=None):
+        self.name = name
+        self.extension = '.' + name
+        self.iter_lines = iter_lines
+        self.content_type = content_type
+        self.compressor = compressor
+
+    def iter_chunks(self, rows):
+        compressor = self.compressor() if self.compressor else None
+        for block in iter_blocks(self.iter_lines(rows)):
+            data = block.encode('utf-8')
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+
+
+class ChunkSink(io.RawIOBase):
+    """A write-only file that keeps what was written until `drain` hands it out."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ArrowResultFormat(ResultFormat):
+    """
+    Columnar output through pyarrow: an Arrow IPC stream or a Parquet file, written
+    one record batch of RESULT_EXPORT_CHUNK_SIZE rows at a time. Every column is a string.
+    """
+
+    def __init__(self, name, extension, parquet=False):
+        self.name = name
+        self.extension = extension
+        self.parquet = parquet
+
+    def open_writer(self, sink, schema):
+        if self.parquet:
+            return pyarrow.parquet.ParquetWriter(sink, schema)
+        return pyarrow.ipc.new_stream(sink, schema)
+
+    def iter_chunks(self, rows):
+        sink = ChunkSink()
+        writer = None
+        for batch in iter_batches(rows, settings.RESULT_EXPORT_CHUNK_SIZE):
+            if writer is None:
+                fieldnames = list(batch[0])
+                schema = pyarrow.schema([(name, pyarrow.string()) for name in fieldnames])
+                writer = self.open_writer(sink, schema)
+            columns = [
+                pyarrow.array([None if row.get(name) is None else str(row.get(name)) for row in batch], pyarrow.string())
+                for name in fieldnames
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+            yield sink.drain()
+
+
+RESULT_FORMATS = OrderedDict()
+
+
+def register_result_format(result_format):
+    RESULT_FORMATS[result_format.name] = result_format
+    return result_format
+
+
+def get_result_format(name):
+    return RESULT_FORMATS.get(name or 'csv')
+
+
+register_result_format(LineResultFormat('csv', iter_result_csv, 'text/csv'))
+register_result_format(LineResultFormat('csv.gz', iter_result_csv, 'application/gzip', gzip_compressor))
+register_result_format(LineResultFormat('jsonl', iter_result_jsonl, 'application/x-ndjson'))
+register_result_format(LineResultFormat('jsonl.gz', iter_result_jsonl, 'application/gzip', gzip_compressor))
+if zstandard is not None:
+    register_result_format(LineResultFormat('csv.zst', iter_result_csv, 'application/zstd', zstd_compressor))
+    register_result_format(LineResultFormat('jsonl.zst', iter_result_jsonl, 'application/zstd', zstd_compressor))
+if pyarrow is not None:
+    register_result_format(ArrowResultFormat('arrow', '.arrow'))
+    register_result_format(ArrowResultFormat('parquet', '.parquet', parquet=True))
+
+
+def result_file_name(project, result_format=None):
+    extension = result_format.extension if result_format else '.csv'
+    return '%s_%s_%s_result%s' % (project.id, project.name, project.project_type, extension)
+
+
+def write_result_file(project):
+    with tempfile.TemporaryFile() as f:
+        for chunk in get_result_format('csv').iter_chunks(iter_result_rows(project)):
+            f.write(chunk)
+        f.seek(0)
+        project.result_file.save(result_file_name(project), File(f), save=False)
+    # Only touch result_file, a full save() could overwrite fields changed meanwhile.
+    Project.objects.filter(id=project.id).update(result_file=project.result_file.name)
+    return project.result_file
+
+
+def queue_result_file(project):
+    """
+    Queues a background build of the project's result file, unless one is
+    already queued or running. A failed build is queued again on the next call.
+    """
+    from tasks.models import ResultFileJob
+    from tasks.tasks import build_result_file
+
+    job, created = ResultFileJob.objects.get_or_create(project=project)
+    if created or ResultFileJob.claim(job.id, [ResultFileJob.FAILED, ResultFileJob.FINISHED], ResultFileJob.PENDING):
+        transaction.on_commit(lambda: build_result_file.delay(project.id))
+        job.state = ResultFileJob.PENDING
+    return job
+
+
+def run_result_file_build(project_id):
+    from tasks.models import ResultFileJob
+
+    job = ResultFileJob.objects.select_related('project').filter(project_id=project_id).first()
+    if job is None or not ResultFileJob.claim(job.id, [ResultFileJob.PENDING], ResultFileJob.RUNNING):
+        return job
+    project = job.project
+    ResultFileJob.objects.filter(id=job.id).update(started=timezone.now(), error='')
+    try:
+        if not project.result_file:
+            write_result_file(project)
+            logger.info('Project %s result file written to %s', project.id, project.result_file.name)
+    except Exception as e:
+        logger.exception('Project %s result file failed', project.id)
+        ResultFileJob.objects.filter(id=job.id).update(state=ResultFileJob.FAILED, error=str(e))
+    else:
+        ResultFileJob.objects.filter(id=job.id).update(state=ResultFileJob.FINISHED)
+    return job
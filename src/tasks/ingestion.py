@@ -0,0 +1,376 @@
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import logging
+import hashlib
+import zipfile
+import multiprocessing
+from collections import deque
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from billiard import current_process
+except ImportError:
+    current_process = multiprocessing.current_process
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from annotation.payloads import PayloadStore
+from projects.models import ProjectCounters
+
+
+logger = logging.getLogger(__name__)
+
+
+def member_name(info):
+    """
+    The real name of a zip member. Names flagged as utf-8 are already decoded;
+    anything else was decoded as cp437 by zipfile, which mangles the utf-8 and
+    gbk names most of our archives are made with.
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    raw = info.filename.encode('cp437')
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return info.filename
+
+
+class ZipSource(object):
+    """
+    Yields one task per file of an uploaded zip archive.
+
+    Members are streamed one at a time straight to their final place under
+    `project_file_dir`, so the first tasks are created while the rest of the
+    archive is still being written out. `offset` is the number of members
+    already turned into tasks, so a restarted job skips straight past them.
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, project_file_path, project_file_dir, offset=0):
+        self.project_file_path = project_file_path
+        self.project_file_dir = project_file_dir
+        self.offset = offset
+        self.rows = 0
+        self.bytes_read = 0
+        self.zip_file = zipfile.ZipFile(project_file_path)
+        members = ((member_name(info), info) for info in self.zip_file.infolist() if not info.filename.endswith('/'))
+        self.members = sorted(
+            ((name, info) for name, info in members if not self.is_metadata(name)),
+            key=lambda member: member[0],
+        )
+        self.bytes_total = sum(info.file_size for name, info in self.members)
+
+    @staticmethod
+    def is_metadata(name):
+        # macOS resource forks under __MACOSX/ and dot-files such as .DS_Store are not task files.
+        parts = name.split('/')
+        return parts[0] == '__MACOSX' or any(part.startswith('.') for part in parts)
+
+    def target_path(self, name):
+        root = os.path.abspath(self.project_file_dir)
+        path = os.path.abspath(os.path.join(root, name))
+        if not path.startswith(root + os.sep):
+            return None
+        return path
+
+    def write(self, info, path):
+        if os.path.exists(path) and os.path.getsize(path) == info.file_size:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + '.part'
+        with self.zip_file.open(info) as src, open(partial, 'wb') as dst:
+            shutil.copyfileobj(src, dst, self.chunk_size)
+        os.replace(partial, path)
+
+    def __iter__(self):
+        for name, info in self.members[:self.offset]:
+            self.bytes_read += info.file_size
+        with self.zip_file:
+            for name, info in self.members[self.offset:]:
+                path = self.target_path(name)
+                self.offset += 1
+                self.bytes_read += info.file_size
+                if path is None:
+                    logger.warning('Skipping zip member outside of the archive root: %s', name)
+                    continue
+                self.write(info, path)
+                self.rows += 1
+                yield {'file_path': path}
+
+
+class CsvSource(object):
+    """
+    Yields one task per row of an uploaded csv file, keeping the row itself as
+    the task payload instead of writing it out to a file of its own.
+
+    The file is read in binary so that `offset` is always the byte position of
+    the next unread record; a restarted job seeks there and reuses the stored
+    header instead of parsing the file from the top again.
+    """
+
+    def __init__(self, project_file_path, offset=0, fieldnames=None):
+        self.project_file_path = project_file_path
+        self.offset = offset
+        self.fieldnames = fieldnames
+        self.rows = 0
+        self.bytes_read = offset
+        self.bytes_total = os.path.getsize(project_file_path)
+
+    def lines(self, f):
+        for line in iter(f.readline, b''):
+            self.bytes_read += len(line)
+            yield line.decode('utf-8')
+
+    def __iter__(self):
+        with open(self.project_file_path, 'rb') as f:
+            f.seek(self.offset)
+            reader = csv.DictReader(self.lines(f), fieldnames=self.fieldnames)
+            for row in reader:
+                self.fieldnames = reader.fieldnames
+                self.rows += 1
+                self.offset = self.bytes_read
+                yield {'payload': row}
+
+
+def is_daemon_process():
+    return current_process().daemon or multiprocessing.current_process().daemon
+
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp'}
+
+
+def inspect_file(path):
+    """
+    Hashes one ingested file and, for images, checks that it decodes and reads
+    its dimensions. Runs in a worker process, so it must not touch the database.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    fields = {'file_hash': sha1.hexdigest()}
+    if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+        from PIL import Image
+
+        try:
+            with Image.open(path) as image:
+                image.verify()
+            with Image.open(path) as image:
+                fields['width'], fields['height'] = image.size
+        except Exception as e:
+            logger.warning('Invalid image %s: %s', path, e)
+    return fields
+
+
+class InspectedSource(object):
+    """
+    Wraps a file source and runs `inspect_file` for every file on a process pool.
+    Celery prefork children are daemonic and may not start processes of their
+    own, so there a thread pool is used instead; hashlib and Pillow's decoders
+    release the GIL, so the threads still spread over the cores.
+
+    At most `in_flight` files are submitted ahead of the one being yielded, so
+    memory stays bounded while every core is kept busy. Rows come out in source
+    order and carry the source's position as it was when that row was read, so
+    a job resumed from a flushed batch never skips a file still in the pool.
+    """
+
+    def __init__(self, source, workers=None, in_flight=None):
+        self.source = source
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.in_flight = in_flight or max(self.workers, 1) * settings.TASK_INGEST_IN_FLIGHT_PER_WORKER
+        self.rows = 0
+        self.offset = source.offset
+        self.bytes_read = source.bytes_read
+        self.bytes_total = source.bytes_total
+
+    def __iter__(self):
+        if not self.workers:
+            for fields in self.source:
+                fields.update(inspect_file(fields['file_path']))
+                self.rows, self.offset, self.bytes_read = self.source.rows, self.source.offset, self.source.bytes_read
+                yield fields
+            return
+        pending = deque()
+        with self.make_executor() as executor:
+            for fields in self.source:
+                position = (self.source.rows, self.source.offset, self.source.bytes_read)
+                pending.append((fields, position, executor.submit(inspect_file, fields['file_path'])))
+                if len(pending) >= self.in_flight:
+                    yield self.finish(*pending.popleft())
+            while pending:
+                yield self.finish(*pending.popleft())
+
+    def make_executor(self):
+        if is_daemon_process():
+            return ThreadPoolExecutor(max_workers=self.workers)
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def finish(self, fields, position, future):
+        fields.update(future.result())
+        self.rows, self.offset, self.bytes_read = position
+        return fields
+
+
+def get_source(project, offset=0, fieldnames=None):
+    name, ext = os.path.splitext(os.path.basename(project.project_file.name))
+    project_file_path = os.path.join(settings.MEDIA_ROOT, project.project_file.name)
+    if ext == '.zip':
+        project_file_dir = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(project_file_dir, exist_ok=True)
+        source = ZipSource(project_file_path, project_file_dir, offset)
+        return InspectedSource(source, settings.TASK_INGEST_WORKERS)
+    elif ext == '.csv':
+        return CsvSource(project_file_path, offset, fieldnames)
+    return None
+
+
+class IngestStats(object):
+    def __init__(self, rows=0, tasks=0, contributions=0):
+        self.rows = rows
+        self.tasks = tasks
+        self.contributions = contributions
+        self.rows_at_start = rows
+        self.started = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def rows_per_second(self):
+        if self.elapsed > 0:
+            return (self.rows - self.rows_at_start) / self.elapsed
+        return 0.0
+
+    def __str__(self):
+        return '%d rows, %d tasks, %d contributions in %.2fs (%.1f rows/s)' % (
+            self.rows, self.tasks, self.contributions, self.elapsed, self.rows_per_second
+        )
+
+
+class TaskIngestor(object):
+    """
+    Turns a task source into Task and Contribution rows with bulk_create.
+
+    Rows are consumed lazily and flushed every `batch_size` rows, so memory stays
+    bounded by one batch no matter how large the uploaded file is. When a job is
+    given, its progress and resume offset are committed together with each batch.
+    """
+
+    def __init__(self, project, job=None, batch_size=None):
+        self.project = project
+        self.job = job
+        self.batch_size = batch_size or settings.TASK_INGEST_BATCH_SIZE
+        self.repetition_rate = Decimal(project.repetition_rate)
+        if job:
+            self.stats = IngestStats(job.rows_parsed, job.rows_inserted)
+        else:
+            self.stats = IngestStats()
+        self.last_task_id = project.task_set.aggregate(last=Max('id'))['last'] or 0
+        self.payload_store = PayloadStore('projects', project.id)
+
+    def copies_for_batch(self, size):
+        # For 1 < rr < 2 the number of doubled tasks must equal int((rr - 1) * total),
+        # so every batch takes its exact share and spreads it randomly inside the batch.
+        rr = self.repetition_rate
+        if not 1 < rr < 2:
+            return [int(rr)] * size
+        done = self.stats.tasks
+        doubled = int((rr - 1) * (done + size)) - int((rr - 1) * done)
+        copies = [1] * size
+        for i in random.sample(range(size), doubled):
+            copies[i] = 2
+        return copies
+
+    def flush(self, batch, source):
+        from tasks.models import Task, Contribution, IngestJob
+
+        copies = self.copies_for_batch(len(batch))
+        rows = [fields.pop('payload') for fields in batch if 'payload' in fields]
+        if rows:
+            for fields, stored in zip(batch, self.payload_store.save(rows)):
+                fields.update(stored)
+        with transaction.atomic():
+            Task.objects.bulk_create(
+                [Task(project=self.project, copy=copy, **fields) for fields, copy in zip(batch, copies)],
+                batch_size=self.batch_size,
+            )
+            # MySQL does not hand primary keys back from bulk_create, read them by watermark.
+            created = list(
+                Task.objects.filter(project=self.project, id__gt=self.last_task_id)
+                .order_by('id').values_list('id', 'copy')
+            )
+            contributions = [
+                Contribution(project=self.project, task_id=task_id)
+                for task_id, copy in created for _ in range(copy)
+            ]
+            Contribution.objects.bulk_create(contributions, batch_size=self.batch_size)
+            ProjectCounters.bump(self.project.id, total_tasks=len(created), total_copies=len(contributions))
+            self.stats.rows = self.stats.rows_at_start + source.rows
+            self.stats.tasks += len(created)
+            self.stats.contributions += len(contributions)
+            if self.job:
+                IngestJob.objects.filter(id=self.job.id).update(
+                    offset=source.offset,
+                    fieldnames=json.dumps(getattr(source, 'fieldnames', None)),
+                    rows_parsed=self.stats.rows,
+                    rows_inserted=self.stats.tasks,
+                    bytes_read=source.bytes_read,
+                    bytes_total=source.bytes_total,
+                    updated=timezone.now(),
+                )
+        if created:
+            self.last_task_id = created[-1][0]
+        logger.info('Project %s ingest: %s', self.project.id, self.stats)
+
+    def ingest(self, source):
+        batch = []
+        for fields in source:
+            batch.append(fields)
+            if len(batch) >= self.batch_size:
+                self.flush(batch, source)
+                batch = []
+        self.flush(batch, source)
+        return self.stats
+
+
+class IngestJobRunning(Exception):
+    """The job is owned by a run that has not gone stale yet, try again once it may have."""
+
+
+def run_ingest_job(job_id):
+    from tasks.models import IngestJob
+
+    job = IngestJob.objects.select_related('project').get(id=job_id)
+    # Only one run may own a job, a duplicate or redelivered message finds it already taken.
+    if not IngestJob.claim(job.id, [IngestJob.PENDING], IngestJob.RUNNING):
+        job.refresh_from_db(fields=['state'])
+        if job.state == IngestJob.RUNNING:
+            raise IngestJobRunning('Ingest job %s is running elsewhere' % job.id)
+        return job
+    project = job.project
+    IngestJob.objects.filter(id=job.id).update(started=timezone.now(), error='')
+    try:
+        fieldnames = json.loads(job.fieldnames) if job.fieldnames else None
+        source = get_source(project, job.offset, fieldnames)
+        if source is not None:
+            TaskIngestor(project, job=job).ingest(source)
+    except Exception as e:
+        logger.exception('Project %s ingest failed', project.id)
+        IngestJob.objects.filter(id=job.id).update(state=IngestJob.FAILED, error=str(e))
+    else:
+        IngestJob.objects.filter(id=job.id).update(state=IngestJob.FINISHED)
+    job.restore_project_status()
+    return job
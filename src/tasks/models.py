@@ -1,52 +1,88 @@
-import os
-import csv
-import zipfile
 import random
-from collections import Counter
+from decimal import Decimal
+from collections import Counter, defaultdict
 from celery import current_app
-from datetime import datetime, timedelta
+from datetime import timedelta
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count
 from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_init
 
-from projects.models import Project, Status
-from annotation.utils import get_filename_ext, random_string_generator
+from projects.models import Project, Status, ProjectCounters
+from annotation.utils import random_string_generator
+from annotation.payloads import PayloadStore
+from annotation.content import invalidate_text_content
 
 
-from tasks.tasks import calling_submit
+from tasks.tasks import ingest_project
 
 
 User = get_user_model()
 
+INGESTING = 'ingesting'
+
 
 class Task(models.Model):
     project = models.ForeignKey(Project)
     copy = models.IntegerField(blank=True, null=True)
-    file_path = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=255, blank=True)
+    payload = models.TextField(blank=True)
+    payload_index = models.IntegerField(blank=True, null=True)
+    file_hash = models.CharField(max_length=40, blank=True)
+    width = models.IntegerField(blank=True, null=True)
+    height = models.IntegerField(blank=True, null=True)
     label = models.CharField(max_length=255, blank=True)
     updated = models.DateTimeField(auto_now=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'updated']),
+        ]
+
     def __str__(self):
         return str(self.project) + '_' + str(self.id)
 
+    @property
+    def payload_store(self):
+        return PayloadStore('projects', self.project_id)
+
+    def load_payload(self):
+        return self.payload_store.load(self.payload, self.payload_index)
+
 
 class Contribution(models.Model):
     project = models.ForeignKey(Project)
     task = models.ForeignKey(Task)
     label = models.CharField(max_length=255, blank=True)
     contributor = models.ForeignKey(User, blank=True, null=True)
+    leased_to = models.ForeignKey(User, blank=True, null=True, related_name='leased_contributions')
+    lease_expires = models.DateTimeField(blank=True, null=True)
     submitted = models.BooleanField(default=False)
+    submit_after = models.DateTimeField(blank=True, null=True)
     created = models.DateTimeField(null=True)
     updated = models.DateTimeField(auto_now=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Free contributions are looked for in id order, the lease is checked on each row of that scan.
+            models.Index(fields=['project', 'label', 'id']),
+            models.Index(fields=['project', 'contributor', 'created']),
+            models.Index(fields=['submit_after']),
+        ]
+
     def __str__(self):
         return str(self.task) + '_' + str(self.id)
 
+    def is_leased_to_other(self, user):
+        return bool(self.leased_to_id and self.leased_to_id != user.id and self.lease_expires
+                    and self.lease_expires > timezone.now())
+
 
 class Inspection(models.Model):
     project = models.ForeignKey(Project)
@@ -54,133 +90,320 @@ class Inspection(models.Model):
     label = models.CharField(max_length=255, blank=True)
     inspector = models.ForeignKey(User, blank=True, null=True)
     submitted = models.BooleanField(default=False)
+    submit_after = models.DateTimeField(blank=True, null=True)
     created = models.DateTimeField(null=True)
     updated = models.DateTimeField(auto_now=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['submit_after']),
+        ]
+
     def __str__(self):
         return str(self.task) + '_' + str(self.id)
 
 
+class BackgroundJob(models.Model):
+    """
+    State of a background job on one project, kept in the database so that web
+    and Celery processes agree on it. Moves between states go through `claim`.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    state = models.CharField(max_length=16, default=PENDING)
+    error = models.TextField(blank=True)
+    started = models.DateTimeField(null=True)
+    updated = models.DateTimeField(auto_now=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return str(self.project) + '_' + self.state
+
+    @property
+    def owner(self):
+        return self.project.founder
+
+    @classmethod
+    def stale_seconds(cls):
+        return settings.TASK_INGEST_STALE_SECONDS
+
+    @classmethod
+    def claim(cls, job_id, states, state):
+        """
+        Moves a job into `state` if it is still in one of `states`, and tells
+        whether this caller won. A running job not updated for `stale_seconds`
+        counts as abandoned and can be claimed again.
+        """
+        now = timezone.now()
+        claimable = models.Q(state__in=states) | models.Q(
+            state=cls.RUNNING, updated__lt=now - timedelta(seconds=cls.stale_seconds())
+        )
+        return bool(cls.objects.filter(claimable, id=job_id).update(state=state, updated=now))
+
+
+class IngestJob(BackgroundJob):
+    project = models.OneToOneField(Project, related_name='ingest_job')
+    previous_status = models.CharField(max_length=128, blank=True)
+    offset = models.BigIntegerField(default=0)
+    fieldnames = models.TextField(blank=True)
+    rows_parsed = models.BigIntegerField(default=0)
+    rows_inserted = models.BigIntegerField(default=0)
+    bytes_read = models.BigIntegerField(default=0)
+    bytes_total = models.BigIntegerField(default=0)
+
+    @property
+    def eta(self):
+        if self.state != self.RUNNING or not self.started or not self.bytes_read:
+            return None
+        elapsed = (timezone.now() - self.started).total_seconds()
+        remaining = self.bytes_total - self.bytes_read
+        return int(remaining * elapsed / self.bytes_read)
+
+    def restore_project_status(self):
+        Project.objects.filter(id=self.project_id, status=INGESTING).update(
+            status=self.previous_status or 'unreleased'
+        )
+
+
+class ResultFileJob(BackgroundJob):
+    project = models.OneToOneField(Project, related_name='result_file_job')
+
+    @classmethod
+    def stale_seconds(cls):
+        return settings.RESULT_EXPORT_LOCK_SECONDS
+
+
+def get_ingesting_status():
+    status, created = Status.objects.get_or_create(
+        project_status=INGESTING,
+        defaults={
+            'id': 0,
+            'project_status_name': '导入中',
+            'verify_status': 'unverified',
+            'verify_status_name': '未审核',
+        },
+    )
+    return status
+
+
 def create_tasks(instance):
-    name, ext = get_filename_ext(instance.project_file.name)
-    project_file_path = os.path.join(settings.MEDIA_ROOT, instance.project_file.name)
-    project_file_dir = os.path.join(settings.MEDIA_ROOT, name)
-    os.mkdir(project_file_dir)
-    rr = instance.repetition_rate
-
-    if ext == '.zip':
-        zf = zipfile.ZipFile(project_file_path, 'r')
-        zf.extractall(path=project_file_dir)
-        inner_dir_name = os.listdir(project_file_dir)[0]
-        project_file_path = os.path.join(project_file_dir, inner_dir_name)
-        final_project_file_path = project_file_path.encode('cp437').decode('gbk')
-        os.rename(project_file_path, final_project_file_path)
-        file_name_list = os.listdir(final_project_file_path)
-
-        for file_name in file_name_list:
-            Task.objects.create(
-                project=instance,
-                file_path=os.path.join(final_project_file_path, file_name),
-                copy=int(rr),
-            )
-
-    elif ext == '.csv':
-        inner_dir_name = '%s' % instance.name
-        project_file_dir = os.path.join(project_file_dir, inner_dir_name)
-        os.mkdir(project_file_dir)
-        reader = csv.DictReader(open(project_file_path, encoding='utf-8'))
-
-        for row in reader:
-            file_name = '%s.csv' % row['\ufeffid']
-            final_project_file_path = os.path.join(project_file_dir, file_name)
-            f = open(final_project_file_path, 'w', newline='', encoding='utf-8')
-            writer = csv.DictWriter(f, dialect='excel', fieldnames=reader.fieldnames)
-            writer.writeheader()
-            writer.writerow(row)
-            Task.objects.create(
-                project=instance,
-                file_path=final_project_file_path,
-                copy=int(rr),
-            )
-
-    if 1 < rr < 2:
-        length = instance.task_set.count()
-        num = int((rr - 1) * length)
-        ids = instance.task_set.values_list("id", flat=True)
-        rand_list = random.sample(set(ids), num)
-        for i in rand_list:
-            Task.objects.filter(id=i).update(copy=2)
-
-    for task in Task.objects.filter(project=instance):
-        for copy in range(task.copy):
-            Contribution.objects.create(project=instance, task=task)
+    job, created = IngestJob.objects.get_or_create(project=instance)
+    previous_status = instance.status_id
+    if previous_status == INGESTING:
+        previous_status = job.previous_status
+    IngestJob.objects.filter(id=job.id).update(
+        state=IngestJob.PENDING,
+        previous_status=previous_status,
+        offset=0,
+        fieldnames='',
+        rows_parsed=0,
+        rows_inserted=0,
+        bytes_read=0,
+        bytes_total=0,
+        error='',
+        started=None,
+    )
+    Project.objects.filter(id=instance.id).update(status=get_ingesting_status())
+    transaction.on_commit(lambda: ingest_project.delay(job.id))
+    return job
+
+
+def rebalance_copies(project, repetition_rate, batch_size=None):
+    """
+    Brings the tasks and contributions of a project in line with a new repetition rate.
+
+    The target copy count of every task is computed first; tasks already doubled
+    keep their second copy when 1 < rate < 2. Only the difference is written:
+    missing contributions are bulk-inserted and surplus ones deleted, unlabelled
+    and unleased ones first. Labelled contributions are never deleted, and tasks
+    that already have a label never get new copies.
+
+    Tasks that lost copies may now have all of their remaining copies submitted,
+    so they are settled afterwards, and the project moves on to 'checking' once
+    no copy is left unsubmitted.
+    """
+    batch_size = batch_size or settings.TASK_INGEST_BATCH_SIZE
+    rate = Decimal(repetition_rate)
+    tasks = list(Task.objects.filter(project=project).values_list('id', 'copy', 'label'))
+    if 1 < rate < 2:
+        doubled = int((rate - 1) * len(tasks))
+        ranked = sorted(tasks, key=lambda task: ((task[1] or 0) < 2, random.random()))
+        targets = {task_id: 2 if i < doubled else 1 for i, (task_id, copy, label) in enumerate(ranked)}
+    else:
+        targets = {task_id: int(rate) for task_id, copy, label in tasks}
+    for task_id, copy, label in tasks:
+        if label and copy is not None:
+            targets[task_id] = min(targets[task_id], copy)
+    counts = dict(
+        Contribution.objects.filter(project=project).order_by().values('task')
+        .annotate(count=Count('id')).values_list('task', 'count')
+    )
+    changed = defaultdict(list)
+    for task_id, copy, label in tasks:
+        if copy != targets[task_id]:
+            changed[targets[task_id]].append(task_id)
+    missing = [
+        Contribution(project=project, task_id=task_id)
+        for task_id, target in targets.items() for _ in range(target - counts.get(task_id, 0))
+    ]
+    surplus = {task_id: counts.get(task_id, 0) - target for task_id, target in targets.items()
+               if counts.get(task_id, 0) > target}
+    with transaction.atomic():
+        for copy, task_ids in changed.items():
+            for i in range(0, len(task_ids), batch_size):
+                Task.objects.filter(id__in=task_ids[i:i + batch_size]).update(copy=copy)
+        Contribution.objects.bulk_create(missing, batch_size=batch_size)
+        task_ids = list(surplus)
+        for i in range(0, len(task_ids), batch_size):
+            spare = Contribution.objects.filter(task_id__in=task_ids[i:i + batch_size], label='')\
+                .order_by('task', 'lease_expires', '-id').values_list('id', 'task_id')
+            doomed = []
+            for contribution_id, task_id in spare:
+                if surplus[task_id] > 0:
+                    doomed.append(contribution_id)
+                    surplus[task_id] -= 1
+            Contribution.objects.filter(id__in=doomed).delete()
+        ProjectCounters.refresh([project.id])
+        for i in range(0, len(task_ids), batch_size):
+            for task in Task.objects.filter(id__in=task_ids[i:i + batch_size], label=''):
+                settle_task(task, project)
+        counters = ProjectCounters.objects.get(project_id=project.id)
+        if counters.submitted_copies >= counters.total_copies:
+            Project.objects.filter(id=project.id, status='answering').update(status='checking')
 
 
 @receiver(pre_save, sender=Project)
 def project_file_pre_receiver(sender, instance, **kwargs):
-    try:
-        obj = Project.objects.get(id=instance.id)
-        if instance.project_file and (not instance.project_file.name == obj.project_file.name):
-            obj.task_set.all().delete()
-            instance.is_file_changed = True
-        else:
-            instance.is_file_changed = False
-            instance.project_file = obj.project_file
-        if not instance.repetition_rate == obj.repetition_rate and not instance.is_file_changed:
-            Contribution.objects.filter(project=instance).delete()
-            Task.objects.filter(project=instance.id).update(copy=int(instance.repetition_rate))
-            if 1 < instance.repetition_rate < 2:
-                length = instance.task_set.count()
-                num = int((instance.repetition_rate - 1) * length)
-                ids = instance.task_set.values_list("id", flat=True)
-                rand_list = random.sample(set(ids), num)
-                for i in rand_list:
-                    Task.objects.filter(id=i).update(copy=2)
-            for task in Task.objects.filter(project=instance):
-                for copy in range(task.copy):
-                    Contribution.objects.create(project=instance, task=task)
-    except:
-        pass
+    obj = Project.objects.filter(id=instance.id).first()
+    if obj is None:
+        return
+    if instance.project_file and (not instance.project_file.name == obj.project_file.name):
+        obj.task_set.all().delete()
+        ProjectCounters.reset(instance.id)
+        PayloadStore('projects', instance.id).clear()
+        invalidate_text_content('projects', instance.id)
+        instance.is_file_changed = True
+    else:
+        instance.is_file_changed = False
+        instance.project_file = obj.project_file
+    instance._rate_changed = not instance.repetition_rate == obj.repetition_rate and not instance.is_file_changed
 
 
 @receiver(post_save, sender=Project)
 def project_file_post_receiver(sender, instance, created, *args, **kwargs):
+    # After the save, so that settling tasks can move the project on without the save undoing it.
+    if getattr(instance, '_rate_changed', False):
+        instance._rate_changed = False
+        rebalance_copies(instance, instance.repetition_rate)
     if (instance.is_file_changed or created) and instance.project_file:
         create_tasks(instance)
 
 
+@receiver(post_init, sender=Task)
+def task_init_receiver(sender, instance, *args, **kwargs):
+    instance._label_was = instance.__dict__.get('label')
+
+
+@receiver(post_init, sender=Contribution)
+@receiver(post_init, sender=Inspection)
+def contribution_init_receiver(sender, instance, *args, **kwargs):
+    instance._submitted_was = instance.__dict__.get('submitted')
+    instance._label_was = instance.__dict__.get('label')
+
+
 @receiver(post_save, sender=Contribution)
-def contribution_submit_receiver(sender, instance, *args, **kwargs):
-    if instance.label and not instance.submitted:
-        date = datetime.utcnow() + timedelta(seconds=5)  # days=1
-        calling_submit.apply_async((instance,), eta=date)
+@receiver(post_save, sender=Inspection)
+def task_touch_receiver(sender, instance, *args, **kwargs):
+    # Task.updated is the watermark of delta result exports, so it moves with its contributions and inspection too.
+    if instance.label != instance._label_was or instance.submitted != bool(instance._submitted_was):
+        Task.objects.filter(id=instance.task_id).update(updated=timezone.now())
+    instance._label_was = instance.label
+
+
+@receiver(post_save, sender=Task)
+def task_counter_receiver(sender, instance, *args, **kwargs):
+    if bool(instance.label) != bool(instance._label_was):
+        ProjectCounters.bump(instance.project_id, labelled_tasks=1 if instance.label else -1)
+    instance._label_was = instance.label
 
 
 @receiver(post_save, sender=Contribution)
-def contribution_updated_receiver(sender, instance, *args, **kwargs):
-    tasks = instance.project.task_set.all()
-    project = instance.project
-    if project.progress == '100%':
-        Project.objects.filter(id=project.id).update(status='checking')
-        for task in tasks:
-            labels = task.contribution_set.values_list('label', flat=True)
-            if len(set(labels)) == 1:
-                task.label = labels[0]
-            else:
-                top_labels = Counter(labels).most_common(2)
-                if top_labels[0][1] != top_labels[1][1]:
-                    task.label = top_labels[0][0]
-                else:
-                    Inspection.objects.create(task=task, project=instance.project)
-            task.save()
+def contribution_counter_receiver(sender, instance, *args, **kwargs):
+    if instance.submitted != bool(instance._submitted_was):
+        ProjectCounters.bump(instance.project_id, submitted_copies=1 if instance.submitted else -1)
+    instance._submitted_was = instance.submitted
 
 
 @receiver(post_save, sender=Inspection)
-def inspection_submit_receiver(sender, instance, *args, **kwargs):
-    if instance.label and not instance.submitted:
-        date = datetime.utcnow() + timedelta(seconds=5)  # days=1
-        calling_submit.apply_async((instance,), eta=date)
+def inspection_counter_receiver(sender, instance, created, *args, **kwargs):
+    if created and not instance.submitted:
+        ProjectCounters.bump(instance.project_id, open_inspections=1)
+    elif not created and instance.submitted != bool(instance._submitted_was):
+        ProjectCounters.bump(instance.project_id, open_inspections=-1 if instance.submitted else 1)
+    instance._submitted_was = instance.submitted
+
+
+@receiver(post_save, sender=Contribution)
+def contribution_updated_receiver(sender, instance, *args, **kwargs):
+    if instance.submitted:
+        settle_task(instance.task, instance.project)
+
+
+def decide_label(labels):
+    top_labels = Counter(labels).most_common(2)
+    if len(top_labels) == 1 or top_labels[0][1] != top_labels[1][1]:
+        return top_labels[0][0]
+    return None
+
+
+def settle_task(task, project):
+    """
+    Decides the label of one task once all of its copies have been submitted.
+
+    Only the task's own contributions are tallied, so the cost of each submission
+    does not grow with the size of the project. A clear majority becomes the task
+    label, a tie opens an Inspection. When the project counters show no copy left
+    unsubmitted, the project moves on to 'checking' before the task is saved, so
+    that task_updated_receiver can still complete it.
+    """
+    with transaction.atomic():
+        # The task row is locked so that copies submitted at the same time settle it exactly once,
+        # and the reads below are locking reads, so they see what those transactions committed.
+        locked = Task.objects.select_for_update().filter(id=task.id).values_list('label', 'copy').first()
+        if locked is None or locked[0] or Inspection.objects.select_for_update().filter(task=task).exists():
+            return
+        labels = list(
+            task.contribution_set.filter(submitted=True).select_for_update().values_list('label', flat=True)
+        )
+        if not labels or len(labels) < (locked[1] or 0):
+            return
+        counters = ProjectCounters.objects.select_for_update().filter(project_id=project.id)\
+            .values_list('total_copies', 'submitted_copies').first()
+        if counters is not None and counters[1] >= counters[0]:
+            Project.objects.filter(id=project.id).update(status='checking')
+        label = decide_label(labels)
+        if label is not None:
+            task.label = label
+        else:
+            Inspection.objects.create(task=task, project=project)
+        task.save()
+
+
+@receiver(pre_save, sender=Contribution)
+@receiver(pre_save, sender=Inspection)
+def submit_after_receiver(sender, instance, *args, **kwargs):
+    # Labelled rows are submitted by the tasks.tasks.submit_due sweeper once submit_after has passed.
+    if instance.submitted or not instance.label:
+        instance.submit_after = None
+    elif instance.submit_after is None:
+        instance.submit_after = timezone.now() + timedelta(seconds=settings.AUTO_SUBMIT_DELAY_SECONDS)
 
 
 @receiver(post_save, sender=Inspection)
@@ -0,0 +1,77 @@
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from projects.models import ProjectCounters
+from tasks.models import Task, Contribution, Inspection, settle_task
+
+
+logger = logging.getLogger(__name__)
+
+
+def due(model, now):
+    return model.objects.filter(submitted=False, submit_after__lte=now).exclude(label='')
+
+
+def submit_due_contributions(now, batch_size):
+    with transaction.atomic():
+        rows = list(
+            due(Contribution, now).select_for_update().order_by('submit_after')
+            .values_list('id', 'project_id', 'task_id')[:batch_size]
+        )
+        if not rows:
+            return 0
+        Contribution.objects.filter(id__in=[row[0] for row in rows]).update(submitted=True, submit_after=None)
+        for project_id, count in Counter(row[1] for row in rows).items():
+            ProjectCounters.bump(project_id, submitted_copies=count)
+        tasks = Task.objects.filter(id__in={row[2] for row in rows}).select_related('project')
+        # Stamp the time of this batch, not of the sweep, so the stamp trails its commit as little as possible.
+        tasks.update(updated=timezone.now())
+        for task in tasks:
+            settle_task(task, task.project)
+    return len(rows)
+
+
+def submit_due_inspections(now, batch_size):
+    with transaction.atomic():
+        inspections = list(
+            due(Inspection, now).select_for_update().order_by('submit_after').select_related('task')[:batch_size]
+        )
+        if not inspections:
+            return 0
+        Inspection.objects.filter(id__in=[inspection.id for inspection in inspections])\
+            .update(submitted=True, submit_after=None)
+        for project_id, count in Counter(inspection.project_id for inspection in inspections).items():
+            ProjectCounters.bump(project_id, open_inspections=-count)
+        for inspection in inspections:
+            task = inspection.task
+            task.label = inspection.label
+            task.save()
+    return len(inspections)
+
+
+def submit_due(now=None, batch_size=None):
+    """
+    Submits every labelled contribution and inspection whose submit_after has passed.
+
+    Rows are locked and flipped one batch at a time with a single UPDATE, so a
+    sweep costs one broker message however many labels were saved. The UPDATE
+    bypasses the post_save receivers, so their effects are applied here instead:
+    the progress counters are bumped per project and each affected task is
+    settled once.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.AUTO_SUBMIT_BATCH_SIZE
+    submitted = {'contributions': 0, 'inspections': 0}
+    for key, submit in (('contributions', submit_due_contributions), ('inspections', submit_due_inspections)):
+        while True:
+            count = submit(now, batch_size)
+            submitted[key] += count
+            if count < batch_size:
+                break
+    if any(submitted.values()):
+        logger.info('Auto-submitted %(contributions)d contributions and %(inspections)d inspections', submitted)
+    return submitted
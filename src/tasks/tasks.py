@@ -1,8 +1,36 @@
 from celery import task
+from django.conf import settings
+
+from tasks.ingestion import run_ingest_job, IngestJobRunning
+from tasks.exports import run_result_file_build
 
 
 @task(name='tasks.tasks.calling_submit')
 def calling_submit(instance):
-    instance.submitted = True
-    instance.save()
+    # Nothing schedules this any more, it only drains messages queued before the submit_due sweeper.
+    instance = type(instance).objects.filter(id=instance.id).first()
+    if instance and not instance.submitted:
+        instance.submitted = True
+        instance.save()
+
+
+@task(name='tasks.tasks.submit_due', ignore_result=True)
+def submit_due():
+    from tasks import submission
+
+    submission.submit_due()
+
+
+@task(name='tasks.tasks.ingest_project', bind=True, acks_late=True, max_retries=None)
+def ingest_project(self, job_id):
+    try:
+        run_ingest_job(job_id)
+    except IngestJobRunning as e:
+        # A redelivered message may arrive while its dead run still looks alive; come back
+        # once that run can be taken as abandoned, or has finished after all.
+        raise self.retry(exc=e, countdown=settings.TASK_INGEST_STALE_SECONDS)
+
 
+@task(name='tasks.tasks.build_result_file', acks_late=True)
+def build_result_file(project_id):
+    run_result_file_build(project_id)